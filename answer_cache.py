@@ -0,0 +1,142 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# cache for the answers of QuestionSolver between query_answer and the SPARQL endpoint
+# different wordings of a question end up as the same wd:Q wdt:P lookup, so the typed answer list is
+# stored per (query template, entity, property, extra), with a TTL and a least recently used eviction
+# that keeps the cache under max_bytes. with a path the cache is written to a json file by save() and
+# loaded again by the next run.
+
+import json
+import os
+import threading
+import time
+import zlib
+
+from collections import OrderedDict
+
+from answers import Answer
+from search_cache import MISS
+
+# rough per-entry cost of the key tuple, the entry tuple and the dict slot on top of the strings themselves
+ENTRY_OVERHEAD = 200
+
+
+def entry_size(key, answers):
+    return ENTRY_OVERHEAD + len(json.dumps(answers)) + sum(len(part) for part in key)
+
+
+class AnswerCache:
+    def __init__(self, path=None, ttl=24 * 3600, max_bytes=16 * 1024 * 1024):
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        # key -> (answers, created, size)
+        self.entries = OrderedDict()
+        self.template_ids = {}
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+        if path is not None and os.path.exists(path):
+            self.load()
+
+    def __len__(self):
+        return len(self.entries)
+
+    # templates are identified by a checksum, so a changed query template doesn't reuse old answers
+    def key(self, template, entity, prop, extra):
+        template_id = self.template_ids.get(template)
+        if template_id is None:
+            template_id = self.template_ids[template] = '{:08x}'.format(zlib.crc32(template.encode('utf-8')))
+        return template_id, entity, prop, extra
+
+    def get(self, template, entity, prop, extra):
+        key = self.key(template, entity, prop, extra)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or time.time() - entry[1] > self.ttl:
+                if entry is not None:
+                    self.remove(key)
+                self.misses += 1
+                return MISS
+            self.entries.move_to_end(key)
+            self.hits += 1
+        return [Answer(value, kind) for value, kind in entry[0]]
+
+    def put(self, template, entity, prop, extra, answers):
+        key = self.key(template, entity, prop, extra)
+        # stored as (value, kind) pairs, the same as in the json file
+        answers = [(answer.value, answer.kind) for answer in answers]
+        size = entry_size(key, answers)
+        with self.lock:
+            if key in self.entries:
+                self.remove(key)
+            self.entries[key] = (answers, time.time(), size)
+            self.bytes += size
+            self.evict()
+
+    def remove(self, key):
+        self.bytes -= self.entries.pop(key)[2]
+
+    # drop the least recently used entries until we are back under max_bytes
+    def evict(self):
+        while self.bytes > self.max_bytes and self.entries:
+            self.remove(next(iter(self.entries)))
+            self.evictions += 1
+
+    def load(self):
+        with open(self.path, encoding='utf-8') as cache_file:
+            rows = json.load(cache_file)
+        now = time.time()
+        for template_id, entity, prop, extra, answers, created in rows:
+            if now - created <= self.ttl:
+                key = (template_id, entity, prop, extra)
+                size = entry_size(key, answers)
+                self.entries[key] = (answers, created, size)
+                self.bytes += size
+        self.evict()
+
+    # the entries as the rows of the json file
+    def rows(self):
+        with self.lock:
+            return [list(key) + [answers, created] for key, (answers, created, _) in self.entries.items()]
+
+    # adds the rows of another cache (the workers of batch_runner.py), the newest answers of a key win
+    def merge(self, rows):
+        with self.lock:
+            for template_id, entity, prop, extra, answers, created in rows:
+                key = (template_id, entity, prop, extra)
+                entry = self.entries.get(key)
+                if entry is not None:
+                    if entry[1] >= created:
+                        continue
+                    self.remove(key)
+                size = entry_size(key, answers)
+                self.entries[key] = (answers, created, size)
+                self.bytes += size
+            self.evict()
+
+    def save(self):
+        if self.path is None:
+            return
+        rows = self.rows()
+        # write next to the old file first, so an interrupted run doesn't leave half a cache behind
+        with open(self.path + '.tmp', 'w', encoding='utf-8') as cache_file:
+            json.dump(rows, cache_file, ensure_ascii=False, separators=(',', ':'))
+        os.replace(self.path + '.tmp', self.path)
+
+    def hit_ratio(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def stats(self):
+        return {
+            'entries':   len(self),
+            'bytes':     self.bytes,
+            'hits':      self.hits,
+            'misses':    self.misses,
+            'evictions': self.evictions,
+            'hit_ratio': self.hit_ratio(),
+        }
@@ -0,0 +1,75 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# typed answers for the QA systems, built from the type/datatype of the SPARQL result bindings
+# an Answer keeps the raw value and its kind, the text is only made when the answer is written or printed,
+# and dates are recognized by their shape instead of trying datetime.strptime on every label
+
+XSD = 'http://www.w3.org/2001/XMLSchema#'
+DATE_TYPES = {XSD + 'dateTime', XSD + 'date'}
+NUMBER_TYPES = {XSD + name for name in ('integer', 'int', 'long', 'decimal', 'double', 'float',
+                                        'nonNegativeInteger', 'positiveInteger')}
+
+DATE = 'date'
+NUMBER = 'number'
+ENTITY = 'entity'
+BOOLEAN = 'boolean'
+TEXT = 'text'
+
+# the default output format, the same as the answer files always had
+DATE_FORMAT = '%Y-%m-%d'
+
+
+def is_timestamp(value):
+    # the strings datetime.strptime(value, '%Y-%m-%dT%H:%M:%SZ') accepts, like 1958-08-29T00:00:00Z
+    # (labels of date values come back as plain literals without a datatype)
+    return (len(value) == 20 and value[4] == '-' and value[7] == '-' and value[10] == 'T' and value[13] == ':'
+            and value[16] == ':' and value[19] == 'Z'
+            and (value[:4] + value[5:7] + value[8:10] + value[11:13] + value[14:16] + value[17:19]).isdigit()
+            and '01' <= value[5:7] <= '12' and '01' <= value[8:10] <= '31'
+            and value[11:13] <= '23' and value[14:16] <= '59' and value[17:19] <= '61')
+
+
+class Answer:
+    __slots__ = ('value', 'kind')
+
+    def __init__(self, value, kind=TEXT):
+        self.value = value
+        self.kind = kind
+
+    def format(self, date_format=DATE_FORMAT):
+        if self.kind == DATE:
+            value = self.value
+            return date_format.replace('%Y', value[:4]).replace('%m', value[5:7]).replace('%d', value[8:10])
+        return self.value
+
+    def __str__(self):
+        return self.format()
+
+    def __repr__(self):
+        return 'Answer({!r}, {!r})'.format(self.value, self.kind)
+
+
+def answer_kind(binding):
+    datatype = binding.get('datatype')
+    if datatype is not None:
+        if datatype in DATE_TYPES:
+            return DATE if is_timestamp(binding['value']) else TEXT
+        return NUMBER if datatype in NUMBER_TYPES else TEXT
+    if binding.get('type') == 'uri':
+        return ENTITY
+    return DATE if is_timestamp(binding['value']) else TEXT
+
+
+def from_binding(binding):
+    return Answer(binding['value'], answer_kind(binding))
+
+
+# every value of every row, in one pass over the result set
+def from_bindings(rows):
+    kind = answer_kind
+    return [Answer(binding['value'], kind(binding)) for row in rows for binding in row.values()]
+
+
+def boolean(value):
+    return Answer('Yes' if value else 'No', BOOLEAN)
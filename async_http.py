@@ -0,0 +1,56 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# small non-blocking http client for the asyncio api of the QuestionSolver
+# aiohttp is only needed when the asyncio api is used. requests share the rate limit of transport.py
+
+import asyncio
+import json
+import time
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+from rate_limit import shared_limiter
+from replay import recorder, replay_url
+
+
+class AsyncClient:
+    def __init__(self, limit=10, timeout=30):
+        self.limit = limit
+        self.timeout = timeout
+        self.session = None
+        self.semaphore = None
+        self.recorder = recorder()
+        self.limiter = shared_limiter()
+
+    async def __aenter__(self):
+        if aiohttp is None:
+            raise RuntimeError('The asyncio API needs aiohttp, install it with "pip install aiohttp"')
+        self.session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=self.timeout))
+        # limits the number of requests that are in flight at the same time
+        self.semaphore = asyncio.Semaphore(self.limit)
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.session.close()
+
+    async def get_json(self, url, params, budget=None):
+        # aiohttp only accepts string values in the query string
+        params = {key: str(value) for key, value in params.items()}
+
+        async def send():
+            async with self.semaphore:
+                start = time.perf_counter()
+                async with self.session.get(replay_url(url), params=params) as response:
+                    body = await response.read()
+            if self.recorder is not None:
+                self.recorder.record(url, params, response.status,
+                                     response.headers.get('Content-Type', 'application/json'), body,
+                                     time.perf_counter() - start)
+            return response.status, response.headers, body
+
+        status, headers, body = await self.limiter.call_async(url, send, budget)
+        return json.loads(body)
@@ -0,0 +1,254 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# multi-process batch runner for the QuestionSolver in system.py
+# the spaCy pipeline, matcher and solver are loaded once, then N worker processes are forked that share the
+# loaded model copy-on-write. the input is dealt round-robin over the workers and the answers are merged back
+# into answer_file.txt in input order. what the workers learned (parse cache, answer cache, candidate order) is
+# sent back with their results, merged and saved by the parent.
+#   python3 batch_runner.py --processes 4 < test_questions.txt        (q_id<TAB>question lines)
+#   python3 batch_runner.py --processes 4 all_questions_and_answers.tsv  (gold files, numbered from 1)
+
+import argparse
+import gc
+import io
+import multiprocessing
+import queue
+import resource
+import sys
+import time
+import traceback
+
+from budget import DeadlineExceeded
+from search_cache import SearchCache
+from system import NoAnswerError, add_solver_arguments, build_solver, print_solver_stats, save_solver_state, \
+    write_answers
+
+# results are sent back to the parent in chunks of this many questions
+CHUNK_SIZE = 16
+
+# seconds between the checks whether a worker died without reporting (killed by the OOM killer, segfault)
+POLL_INTERVAL = 1.0
+
+
+def read_input(lines, questions):
+    # adds (q_id, question) for system.py input and for the gold tsv files (question, url, answers...)
+    for line in lines:
+        # skip commented out and empty lines
+        if not line.strip() or line[0] == '#':
+            continue
+        fields = line.strip().split('\t')
+        if len(fields) > 1 and fields[1].startswith('http'):
+            questions.append((str(len(questions) + 1), fields[0]))
+        else:
+            questions.append((fields[0], fields[1]))
+
+
+def peak_rss():
+    # ru_maxrss is in kilobytes on linux and in bytes on macos
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+# resident, proportional and unique memory of this process from /proc, None where that isn't available
+# (rss counts the pages shared copy-on-write with the parent in every worker, uss only what the worker owns)
+def memory():
+    size = {}
+    try:
+        with open('/proc/self/smaps_rollup') as smaps_file:
+            for line in smaps_file:
+                key, _, value = line.partition(':')
+                if value.strip().endswith('kB'):
+                    size[key] = int(value.split()[0]) * 1024
+    except OSError:
+        return None
+    return {
+        'rss': size.get('Rss', 0),
+        'pss': size.get('Pss', 0),
+        'uss': size.get('Private_Clean', 0) + size.get('Private_Dirty', 0),
+    }
+
+
+# the state of a worker that is kept between runs, candidate_order is the CandidateOrder snapshot from the start
+def solver_state(qa_system, candidate_order):
+    state = {}
+    if qa_system.parser.cache is not None:
+        state['parse_cache'] = qa_system.parser.cache.to_bytes()
+    if qa_system.answer_cache is not None:
+        state['answer_cache'] = qa_system.answer_cache.rows()
+    if qa_system.candidate_order is not None:
+        state['candidate_order'] = qa_system.candidate_order.changes(candidate_order)
+    return state
+
+
+def merge_state(qa_system, state):
+    if 'parse_cache' in state:
+        qa_system.parser.cache.merge(state['parse_cache'])
+    if 'answer_cache' in state:
+        qa_system.answer_cache.merge(state['answer_cache'])
+    if 'candidate_order' in state:
+        qa_system.candidate_order.merge(state['candidate_order'])
+
+
+def work(worker, qa_system, questions, indices, results, search_cache_args):
+    try:
+        # a sqlite connection can't be shared with the parent, every worker opens its own
+        if search_cache_args is not None:
+            qa_system.search_cache = SearchCache(*search_cache_args)
+        candidate_order = qa_system.candidate_order.snapshot() if qa_system.candidate_order is not None else None
+        start = time.perf_counter()
+        chunk = []
+        failures = {}
+        for index in indices:
+            try:
+                answers = [str(answer) for answer in qa_system(questions[index][1])]
+            except NoAnswerError:
+                answers = None
+            except DeadlineExceeded as err:
+                # written as "Deadline exceeded" by write_answers
+                answers = err
+            except Exception as err:
+                # an unexpected error only ends this question, it is written as "Answer not found"
+                failures[type(err).__name__] = failures.get(type(err).__name__, 0) + 1
+                answers = None
+            chunk.append((index, answers))
+            if len(chunk) == CHUNK_SIZE:
+                results.put(('answers', worker, chunk))
+                chunk = []
+        if chunk:
+            results.put(('answers', worker, chunk))
+        seconds = time.perf_counter() - start
+        solver_stats = io.StringIO()
+        print_solver_stats(qa_system, solver_stats)
+        if search_cache_args is not None:
+            qa_system.search_cache.close()
+        results.put(('done', worker, {
+            'questions':    len(indices),
+            'seconds':      seconds,
+            'failures':     failures,
+            'peak_rss':     peak_rss(),
+            'memory':       memory(),
+            'solver_stats': solver_stats.getvalue(),
+            'state':        solver_state(qa_system, candidate_order),
+        }))
+    except Exception:
+        results.put(('error', worker, traceback.format_exc()))
+
+
+def run(qa_system, questions, processes, search_cache_args=None):
+    context = multiprocessing.get_context('fork')
+    results = context.Queue()
+    # everything loaded so far stays out of the garbage collector, so the workers don't touch (and copy)
+    # the pages of the model just to look at its objects
+    gc.freeze()
+    workers = [context.Process(target=work, name='worker-{}'.format(worker),
+                               args=(worker, qa_system, questions, range(worker, len(questions), processes), results,
+                                     search_cache_args))
+               for worker in range(processes)]
+    for process in workers:
+        process.start()
+
+    answers = [None] * len(questions)
+    stats = {}
+    try:
+        while len(stats) < processes:
+            try:
+                kind, worker, value = results.get(timeout=POLL_INTERVAL)
+            except queue.Empty:
+                # a worker that was killed never sends 'done', don't wait for it forever
+                for worker, process in enumerate(workers):
+                    if worker not in stats and process.exitcode not in (None, 0):
+                        raise RuntimeError('worker {} died with exit code {}'.format(worker, process.exitcode))
+                continue
+            if kind == 'answers':
+                for index, question_answers in value:
+                    answers[index] = question_answers
+            elif kind == 'done':
+                stats[worker] = value
+            else:
+                raise RuntimeError('worker {} failed:\n{}'.format(worker, value))
+    finally:
+        for process in workers:
+            if process.is_alive() and len(stats) < processes:
+                process.terminate()
+            process.join()
+    return answers, [stats[worker] for worker in range(processes)], memory()
+
+
+def print_stats(stats, wall_time, file, parent_memory=None):
+    total = sum(worker['questions'] for worker in stats)
+    print('{} questions in {:.2f}s with {} workers ({:.2f} questions/s)'.format(
+        total, wall_time, len(stats), total / wall_time if wall_time else 0.0), file=file)
+    shared = parent_memory is not None and all(worker['memory'] is not None for worker in stats)
+    for worker, worker_stats in enumerate(stats):
+        seconds = worker_stats['seconds']
+        if shared:
+            usage = '{:.0f} MB private, {:.0f} MB proportional'.format(
+                worker_stats['memory']['uss'] / 2 ** 20, worker_stats['memory']['pss'] / 2 ** 20)
+        else:
+            usage = 'peak {:.0f} MB resident'.format(worker_stats['peak_rss'] / 2 ** 20)
+        print('worker {}: {} questions in {:.2f}s ({:.2f} questions/s), {}'.format(
+            worker, worker_stats['questions'], seconds, worker_stats['questions'] / seconds if seconds else 0.0,
+            usage), file=file)
+        for line in worker_stats['solver_stats'].splitlines():
+            print('  ' + line, file=file)
+    failures = {}
+    for worker_stats in stats:
+        for name, count in worker_stats['failures'].items():
+            failures[name] = failures.get(name, 0) + count
+    if failures:
+        print('{} questions failed: {}'.format(sum(failures.values()), ', '.join(
+            '{} {}'.format(name, count) for name, count in sorted(failures.items()))), file=file)
+    if shared:
+        # the model is in memory once (in the parent), every worker only adds the pages it wrote to
+        private = sum(worker['memory']['uss'] for worker in stats)
+        print('memory: {:.0f} MB in total, {:.0f} MB resident in the parent (shared with the workers) and {:.0f} MB '
+              'private to the workers'.format((parent_memory['rss'] + private) / 2 ** 20,
+                                              parent_memory['rss'] / 2 ** 20, private / 2 ** 20), file=file)
+    else:
+        # without /proc the resident memory of a worker also counts the pages it shares with the parent
+        print('peak resident memory: {:.0f} MB in a worker, {:.0f} MB in the parent'.format(
+            max((worker['peak_rss'] for worker in stats), default=0) / 2 ** 20, peak_rss() / 2 ** 20), file=file)
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description='Answer a batch of questions with several forked workers')
+    arg_parser.add_argument('input', nargs='*', help='question files, standard input when there are none')
+    arg_parser.add_argument('--processes', metavar='N', type=int, default=multiprocessing.cpu_count(),
+                            help='number of worker processes (default: one per cpu)')
+    arg_parser.add_argument('--output', default='answer_file.txt', help='answer file (default %(default)s)')
+    add_solver_arguments(arg_parser)
+    args = arg_parser.parse_args()
+
+    questions = []
+    if args.input:
+        for path in args.input:
+            with open(path, encoding='utf-8') as questions_file:
+                read_input(questions_file, questions)
+    else:
+        read_input(sys.stdin, questions)
+
+    print('Loading up QA System...')
+    qa_system = build_solver(args)
+    search_cache_args = None
+    if args.search_cache:
+        search_cache_args = (args.search_cache, args.search_cache_ttl, args.search_cache_size)
+        qa_system.search_cache.close()
+        qa_system.search_cache = None
+    print('Ready to go!\n')
+
+    start = time.perf_counter()
+    answers, stats, parent_memory = run(qa_system, questions, max(1, args.processes), search_cache_args)
+    wall_time = time.perf_counter() - start
+
+    with open(args.output, 'w') as answer_file:
+        for (q_id, _), question_answers in zip(questions, answers):
+            write_answers(answer_file, q_id, question_answers)
+    for worker_stats in stats:
+        merge_state(qa_system, worker_stats['state'])
+    save_solver_state(qa_system)
+    print_stats(stats, wall_time, sys.stderr, parent_memory)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,166 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# stage-level benchmark of the QuestionSolver in system.py over the gold question files
+#   python3 benchmark.py selected_questions.tsv all_questions_and_answers.tsv
+#   python3 benchmark.py selected_questions.tsv --save-baseline bench_baseline.json
+#   python3 benchmark.py selected_questions.tsv --baseline bench_baseline.json
+# combine with QA_REPLAY_URL (see replay.py) to benchmark without the live wikidata endpoints
+
+import argparse
+import json
+import sys
+import time
+
+from budget import DeadlineExceeded
+from stages import STAGES, StageTimer
+from system import NoAnswerError, add_solver_arguments, build_solver, print_solver_stats, save_solver_state
+
+# metrics where a higher value is better, for all the others lower is better
+HIGHER_IS_BETTER = {'questions_per_second'}
+
+
+def read_questions(paths):
+    questions = []
+    for path in paths:
+        with open(path, encoding='utf-8') as questions_file:
+            for line in questions_file:
+                # skip commented out and empty lines
+                if not line.strip() or line[0] == '#':
+                    continue
+                questions.append(line.strip().split('\t')[0])
+    return questions
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    position = fraction * (len(ordered) - 1)
+    low = int(position)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (position - low)
+
+
+def run(qa_system, questions):
+    timer = StageTimer()
+    qa_system.use_timer(timer)
+    latencies = []
+    stage_times = {stage: 0.0 for stage in STAGES}
+    remote_calls = {'search': 0, 'sparql': 0}
+    answered = 0
+    deadline_exceeded = 0
+    failures = {}
+    start = time.perf_counter()
+    for question in questions:
+        timer.reset()
+        question_start = time.perf_counter()
+        try:
+            qa_system(question)
+            answered += 1
+        except NoAnswerError:
+            pass
+        except DeadlineExceeded:
+            deadline_exceeded += 1
+        except Exception as err:
+            # an unexpected error only ends this question, the report counts them per exception type
+            failures[type(err).__name__] = failures.get(type(err).__name__, 0) + 1
+        latencies.append(time.perf_counter() - question_start)
+        durations, calls = timer.reset()
+        for stage in STAGES:
+            stage_times[stage] += durations.get(stage, 0.0)
+        for kind, count in calls.items():
+            remote_calls[kind] = remote_calls.get(kind, 0) + count
+    wall_time = time.perf_counter() - start
+
+    n = len(questions) or 1
+    results = {
+        'questions':                 len(questions),
+        'answered':                  answered,
+        'deadline_exceeded':         deadline_exceeded,
+        'failed':                    sum(failures.values()),
+        'failures':                  failures,
+        'wall_time':                 wall_time,
+        'questions_per_second':      len(questions) / wall_time if wall_time else 0.0,
+        'p50':                       percentile(latencies, 0.50),
+        'p95':                       percentile(latencies, 0.95),
+        'p99':                       percentile(latencies, 0.99),
+        'remote_calls_per_question': sum(remote_calls.values()) / n,
+    }
+    for stage, seconds in stage_times.items():
+        results['stage_{}'.format(stage)] = seconds / n
+    for kind, count in remote_calls.items():
+        results['{}_calls_per_question'.format(kind)] = count / n
+    return results
+
+
+def print_results(results, file):
+    print('{questions} questions, {answered} answered in {wall_time:.2f}s ({questions_per_second:.2f} questions/s)'
+          .format(**results), file=file)
+    if results.get('deadline_exceeded'):
+        print('{deadline_exceeded} questions exceeded the deadline or remote call budget, or were throttled'.format(
+            **results), file=file)
+    if results.get('failed'):
+        print('{} questions failed: {}'.format(results['failed'], ', '.join(
+            '{} {}'.format(name, count) for name, count in sorted(results['failures'].items()))), file=file)
+    print('latency p50 {:.1f} ms, p95 {:.1f} ms, p99 {:.1f} ms'.format(
+        results['p50'] * 1000, results['p95'] * 1000, results['p99'] * 1000), file=file)
+    print('remote calls per question: {:.2f} ({:.2f} search, {:.2f} sparql)'.format(
+        results['remote_calls_per_question'], results.get('search_calls_per_question', 0.0),
+        results.get('sparql_calls_per_question', 0.0)), file=file)
+    stage_total = sum(value for key, value in results.items() if key.startswith('stage_')) or 1.0
+    print('{:<12}{:>14}{:>8}'.format('stage', 'ms/question', 'share'), file=file)
+    for key, value in results.items():
+        if key.startswith('stage_'):
+            print('{:<12}{:>14.2f}{:>8.1%}'.format(key[6:], value * 1000, value / stage_total), file=file)
+
+
+# the metrics that got worse than the baseline by more than the tolerance
+def regressions(results, baseline, tolerance):
+    found = []
+    for key, old in baseline.items():
+        new = results.get(key)
+        if key in ('questions', 'answered', 'deadline_exceeded', 'failed', 'failures', 'wall_time') or new is None \
+                or not old:
+            continue
+        change = (new - old) / old
+        worse = -change if key in HIGHER_IS_BETTER else change
+        if worse > tolerance:
+            found.append((key, old, new, change))
+    return found
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description='Benchmark the QuestionSolver stages over gold question files')
+    arg_parser.add_argument('questions', nargs='+', help='tsv files with the question in the first column')
+    arg_parser.add_argument('--baseline', metavar='PATH', help='compare with the results stored in this json file')
+    arg_parser.add_argument('--save-baseline', metavar='PATH', help='store the results in this json file')
+    arg_parser.add_argument('--tolerance', type=float, default=0.10,
+                            help='relative change that counts as a regression (default 0.10)')
+    add_solver_arguments(arg_parser)
+    args = arg_parser.parse_args()
+
+    questions = read_questions(args.questions)
+    qa_system = build_solver(args)
+    results = run(qa_system, questions)
+    save_solver_state(qa_system)
+    print_results(results, sys.stdout)
+    print_solver_stats(qa_system, sys.stdout)
+
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as baseline_file:
+            json.dump(results, baseline_file, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+        found = regressions(results, baseline, args.tolerance)
+        for key, old, new, change in found:
+            print('REGRESSION {}: {:.4g} -> {:.4g} ({:+.1%})'.format(key, old, new, change))
+        if found:
+            sys.exit(1)
+        print('No regressions compared to {}'.format(args.baseline))
+
+
+if __name__ == '__main__':
+    main()
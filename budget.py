@@ -0,0 +1,149 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# per-question deadline and remote call budget for the QuestionSolver
+# every search api and SPARQL request goes through budget.call(request, ...), which refuses the request when
+# the deadline passed or the calls are used up, and limits the http timeouts to the time that is left. the budget
+# goes along to the rate limiter, which counts its retries as calls and never waits past the deadline.
+# running out raises DeadlineExceeded, which is not a NoAnswerError: the question may well have an answer.
+# a request that is still throttled after all retries of the rate limiter (rate_limit.py) ends the question the
+# same way, with reason 'throttled'.
+
+import threading
+import time
+
+import requests
+
+from rate_limit import Throttled
+
+DEADLINE = 'deadline'
+CALLS = 'calls'
+THROTTLED = 'throttled'
+
+MESSAGES = {
+    DEADLINE:  'Deadline exceeded',
+    CALLS:     'Remote call budget exceeded',
+    THROTTLED: 'Throttled by wikidata',
+}
+
+
+class DeadlineExceeded(Exception):
+    # the reason is the only argument, so the error survives pickling (batch_runner.py workers)
+    def __init__(self, reason=DEADLINE):
+        super().__init__(reason)
+        self.reason = reason
+
+    def __str__(self):
+        return MESSAGES[self.reason]
+
+
+class BudgetStats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.questions = 0
+        self.exceeded = {DEADLINE: 0, CALLS: 0, THROTTLED: 0}
+
+    def started(self):
+        with self.lock:
+            self.questions += 1
+
+    def add(self, reason):
+        with self.lock:
+            self.exceeded[reason] += 1
+
+    def stats(self):
+        with self.lock:
+            return {
+                'questions': self.questions,
+                'deadline':  self.exceeded[DEADLINE],
+                'calls':     self.exceeded[CALLS],
+                'throttled': self.exceeded[THROTTLED],
+            }
+
+
+class Budget:
+    def __init__(self, seconds=None, max_calls=None, stats=None):
+        self.deadline = time.perf_counter() + seconds if seconds else None
+        self.max_calls = max_calls
+        self.calls = 0
+        self.stats = stats
+        self.counted = False
+        # the candidates can be queried from several threads at once
+        self.lock = threading.Lock()
+        if stats is not None:
+            stats.started()
+
+    # seconds left, None without a deadline
+    def remaining(self):
+        if self.deadline is None:
+            return None
+        return max(0.0, self.deadline - time.perf_counter())
+
+    # the error to raise, a question is only counted once even when several threads run out
+    def exceeded(self, reason):
+        with self.lock:
+            count = not self.counted
+            self.counted = True
+        if count and self.stats is not None:
+            self.stats.add(reason)
+        return DeadlineExceeded(reason)
+
+    def check(self):
+        if self.deadline is not None and time.perf_counter() >= self.deadline:
+            raise self.exceeded(DEADLINE)
+
+    # claim one remote call, the calls are also counted without a maximum
+    def spend(self):
+        self.check()
+        with self.lock:
+            allowed = self.max_calls is None or self.calls < self.max_calls
+            if allowed:
+                self.calls += 1
+        if not allowed:
+            raise self.exceeded(CALLS)
+
+    # the remote calls that are left, None without a maximum
+    def calls_left(self):
+        if self.max_calls is None:
+            return None
+        with self.lock:
+            return max(0, self.max_calls - self.calls)
+
+    # the (connect, read) timeouts, but never longer than the time that is left
+    def timeout(self, default):
+        remaining = self.remaining()
+        if remaining is None:
+            return default
+        connect, read = default
+        return min(connect, remaining), min(read, remaining)
+
+    # how long the rate limiter may wait: the whole wait, or what is left of the time when the wait has no end
+    # (None, a full window); a wait that would end after the deadline ends the question right away
+    def limit_wait(self, wait):
+        remaining = self.remaining()
+        if remaining is None:
+            return wait
+        if wait is None:
+            if remaining == 0.0:
+                raise self.exceeded(DEADLINE)
+            return remaining
+        if wait >= remaining:
+            raise self.exceeded(DEADLINE)
+        return wait
+
+    # request is transport.get or transport.sparql, which take the timeouts from the budget before every attempt
+    def call(self, request, *args, **kwargs):
+        self.spend()
+        try:
+            return request(*args, budget=self, **kwargs)
+        except requests.Timeout:
+            # the request was cut off because the deadline was reached
+            if self.remaining() == 0.0:
+                raise self.exceeded(DEADLINE)
+            raise
+        except Throttled as err:
+            raise self.exceeded(THROTTLED) from err
+
+
+# no deadline and no limit on the number of calls, and no BudgetStats
+NO_BUDGET = Budget()
@@ -0,0 +1,131 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# learned order of the entity/property candidates that QuestionSolver tries for a question
+# the search api rank is often wrong for some question types (the first hit for "Queen" is not the band),
+# so for every (question type, entity rank, property rank, property id) we count how often the pair was
+# tried and how often it gave the answer, and try the pairs with the best hit rate first.
+# the table is stored as json and keeps learning over runs.
+# the SPARQL calls that really went out are counted per question. the search api order is only compared where it
+# was observed: the pairs were tried one by one and every pair before the winner in the search api order was tried.
+
+import json
+import os
+import threading
+
+# property ids are only trusted after this many tries, before that the rank-only statistics count
+MIN_TRIES = 2
+
+# the statistics of the questions that were recorded
+COUNTERS = ('questions', 'calls', 'compared', 'compared_calls', 'search_order_calls')
+
+
+def ranks(candidates):
+    # search api rank of every entity and property, the candidates are ordered entity by entity
+    entities = {e: rank for rank, e in enumerate(dict.fromkeys(e for e, _ in candidates))}
+    props = {p: rank for rank, p in enumerate(dict.fromkeys(p for _, p in candidates))}
+    return entities, props
+
+
+class CandidateOrder:
+    def __init__(self, path=None):
+        self.path = path
+        # 'q_type entity_rank prop_rank pid' and 'q_type entity_rank prop_rank *' -> [tries, hits]
+        self.table = {}
+        self.questions = 0
+        self.calls = 0
+        self.compared = 0
+        self.compared_calls = 0
+        self.search_order_calls = 0
+        self.lock = threading.Lock()
+        if path is not None and os.path.exists(path):
+            with open(path) as table_file:
+                self.table = json.load(table_file)
+
+    @staticmethod
+    def keys(question_type, entity_rank, prop_rank, pid):
+        prefix = '{} {} {} '.format(question_type, entity_rank, prop_rank)
+        return prefix + (pid or '-'), prefix + '*'
+
+    def score(self, question_type, entity_rank, prop_rank, pid):
+        for key in self.keys(question_type, entity_rank, prop_rank, pid):
+            tries, hits = self.table.get(key, (0, 0))
+            if tries >= MIN_TRIES:
+                # laplace smoothing, a pair that was never tried scores 0.5
+                return (hits + 1) / (tries + 2)
+        return 0.5
+
+    def order(self, question_type, candidates):
+        entities, props = ranks(candidates)
+        with self.lock:
+            scores = [self.score(question_type, entities[e], props[p], p) for e, p in candidates]
+        # sorted is stable, pairs with the same score keep their search api order
+        return [candidates[i] for i in sorted(range(len(candidates)), key=lambda i: -scores[i])]
+
+    # winner is the position in ordered of the pair that gave the answer, or None, calls the number of SPARQL
+    # requests of the question and costs the requests per tried pair when the pairs were tried one by one
+    def record(self, question_type, candidates, ordered, winner, calls, costs=None):
+        entities, props = ranks(candidates)
+        tried = ordered if winner is None else ordered[:winner + 1]
+        with self.lock:
+            for i, (e, p) in enumerate(tried):
+                for key in self.keys(question_type, entities[e], props[p], p):
+                    counts = self.table.setdefault(key, [0, 0])
+                    counts[0] += 1
+                    if i == winner:
+                        counts[1] += 1
+            self.questions += 1
+            self.calls += calls
+            if costs is None:
+                return
+            # what the same question would have cost in the search api order, if we know that
+            search_order = candidates if winner is None else candidates[:candidates.index(ordered[winner]) + 1]
+            if all(pair in costs for pair in search_order):
+                self.compared += 1
+                self.compared_calls += sum(costs[pair] for pair in tried)
+                self.search_order_calls += sum(costs[pair] for pair in search_order)
+
+    # a copy of the table and the statistics, to see later what was learned since (batch_runner.py workers)
+    def snapshot(self):
+        with self.lock:
+            return {key: tuple(counts) for key, counts in self.table.items()}, \
+                {name: getattr(self, name) for name in COUNTERS}
+
+    def changes(self, snapshot):
+        table, counters = snapshot
+        with self.lock:
+            changed = {key: [tries - table.get(key, (0, 0))[0], hits - table.get(key, (0, 0))[1]]
+                       for key, (tries, hits) in self.table.items() if (tries, hits) != table.get(key, (0, 0))}
+            return changed, {name: getattr(self, name) - counters[name] for name in COUNTERS}
+
+    # adds the changes of another CandidateOrder
+    def merge(self, changes):
+        table, counters = changes
+        with self.lock:
+            for key, (tries, hits) in table.items():
+                counts = self.table.setdefault(key, [0, 0])
+                counts[0] += tries
+                counts[1] += hits
+            for name, value in counters.items():
+                setattr(self, name, getattr(self, name) + value)
+
+    def save(self):
+        if self.path is None:
+            return
+        with self.lock:
+            data = json.dumps(self.table, sort_keys=True)
+        with open(self.path + '.tmp', 'w') as table_file:
+            table_file.write(data)
+        os.replace(self.path + '.tmp', self.path)
+
+    def stats(self):
+        with self.lock:
+            questions = self.questions or 1
+            compared = self.compared or 1
+            return {
+                'questions':          self.questions,
+                'calls':              self.calls / questions,
+                'compared':           self.compared,
+                'compared_calls':     self.compared_calls / compared,
+                'search_order_calls': self.search_order_calls / compared,
+            }
@@ -0,0 +1,75 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# thin client for daemon.py: same input and output as system.py, but without loading spaCy
+#   python3 client.py < test_questions.txt                     (unix socket, writes answer_file.txt)
+#   python3 client.py --http http://127.0.0.1:8766 < test_questions.txt
+
+import argparse
+import json
+import socket
+import sys
+import urllib.request
+
+SOCKET_PATH = '/tmp/qa_system.sock'
+
+
+def read_requests(lines):
+    requests = []
+    for line in lines:
+        # skip commented out and empty lines
+        if not line.strip() or line[0] == '#':
+            continue
+        q_id, question = line.rstrip('\n').split('\t')[:2]
+        requests.append({'id': q_id, 'question': question})
+    return requests
+
+
+def ask_socket(path, request):
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(path)
+        with sock.makefile('rwb') as stream:
+            stream.write(json.dumps(request).encode('utf-8') + b'\n')
+            stream.flush()
+            return json.loads(stream.readline())
+
+
+def ask_http(url, request):
+    http_request = urllib.request.Request(url.rstrip('/') + '/batch', json.dumps(request).encode('utf-8'),
+                                          {'Content-Type': 'application/json'})
+    with urllib.request.urlopen(http_request) as response:
+        return json.loads(response.read())
+
+
+def write_answers(answer_file, q_id, answers, deadline_exceeded=None):
+    if deadline_exceeded:
+        answer_file.write(q_id + '\t' + deadline_exceeded + '\n')
+    elif answers:
+        answer_file.write(q_id + '\t' + '\t'.join(answers) + '\n')
+    else:
+        answer_file.write(q_id + '\t' + 'Answer not found' + '\n')
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description='Answer questions from standard input with a running daemon.py')
+    arg_parser.add_argument('--socket', default=SOCKET_PATH, help='unix domain socket path (default %(default)s)')
+    arg_parser.add_argument('--http', metavar='URL', help='use the http endpoint of the daemon instead of the socket')
+    arg_parser.add_argument('--output', default='answer_file.txt', help='answer file (default %(default)s)')
+    args = arg_parser.parse_args()
+
+    request = {'batch': read_requests(sys.stdin)}
+    if args.http:
+        response = ask_http(args.http, request)
+    else:
+        response = ask_socket(args.socket, request)
+    if 'error' in response:
+        sys.exit(response['error'])
+
+    with open(args.output, 'w') as answer_file:
+        for result in response['results']:
+            write_answers(answer_file, result['id'], result['answers'],
+                          result.get('deadline_exceeded') or result.get('throttled'))
+
+
+if __name__ == '__main__':
+    main()
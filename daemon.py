@@ -0,0 +1,217 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# resident QA daemon: loads the spaCy model, matcher and QuestionSolver once and answers questions over
+# a unix domain socket and a local http endpoint
+#   python3 daemon.py [--socket /tmp/qa_system.sock] [--port 8766] [solver options of system.py]
+#
+# protocol (one json object per line on the socket, the same objects as POST body over http):
+#   {"id": "1", "question": "When was Michael Jackson born?"}  ->  {"id": "1", "answers": ["1958-08-29"]}
+#   {"batch": [{"id": "1", "question": ...}, ...]}              ->  {"results": [{"id": "1", "answers": ...}, ...]}
+# answers is null when no answer was found, a question that ran out of time also gets "deadline_exceeded" with the
+# reason (--deadline, --max-remote-calls) and one that wikidata kept throttling gets "throttled". a question that
+# failed with an internal error gets "error", the other questions of its batch are answered as usual; a request
+# that doesn't follow the protocol gets {"error": "bad request: ..."} (http 400). over http: POST /answer,
+# POST /batch or GET /answer?q=...
+# client.py sends the standard input of the old workflow to the daemon and writes answer_file.txt
+
+import argparse
+import json
+import os
+import socketserver
+import sys
+import threading
+import traceback
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+from budget import THROTTLED, DeadlineExceeded
+from pipeline import BatchEngine
+from system import NoAnswerError, add_solver_arguments, build_solver, save_solver_state
+
+SOCKET_PATH = '/tmp/qa_system.sock'
+HTTP_PORT = 8766
+
+BAD_REQUEST = 'bad request: '
+
+
+# what is wrong with a request, None when it follows the protocol
+def invalid(request):
+    if not isinstance(request, dict):
+        return 'a request is a json object'
+    if 'batch' in request:
+        if not isinstance(request['batch'], list):
+            return '"batch" is not a list'
+        if not all(isinstance(entry, dict) and isinstance(entry.get('question'), str) for entry in request['batch']):
+            return 'every entry of "batch" needs a "question" string'
+        return None
+    if not isinstance(request.get('question'), str):
+        return '"question" is missing or not a string'
+    return None
+
+
+# the response for one question, answers is a list of Answers, None, the DeadlineExceeded error or the internal
+# error the question failed with
+def response_for(q_id, answers):
+    if isinstance(answers, DeadlineExceeded):
+        key = 'throttled' if answers.reason == THROTTLED else 'deadline_exceeded'
+        return {'id': q_id, 'answers': None, key: str(answers)}
+    if isinstance(answers, Exception):
+        return {'id': q_id, 'answers': None, 'error': 'internal error: {!r}'.format(answers)}
+    return {'id': q_id, 'answers': [str(answer) for answer in answers] if answers is not None else None}
+
+
+class QADaemon:
+    def __init__(self, qa_system, batch_size=32):
+        self.qa_system = qa_system
+        self.batch_size = batch_size
+        # the spaCy pipeline is shared, so questions are answered one request at a time
+        self.lock = threading.Lock()
+
+    def answer(self, q_id, question):
+        with self.lock:
+            try:
+                answers = self.qa_system(question)
+            except NoAnswerError:
+                answers = None
+            except DeadlineExceeded as err:
+                answers = err
+            except Exception as err:
+                traceback.print_exc()
+                answers = err
+        return response_for(q_id, answers)
+
+    def answer_batch(self, requests):
+        # a batch goes through the pipelined engine, so parsing, searching and querying overlap;
+        # the lines carry the position in the batch, the ids of the client can be anything
+        lines = ['{}\t{}'.format(i, ' '.join(request['question'].split())) for i, request in enumerate(requests)]
+        with self.lock:
+            engine = BatchEngine(self.qa_system, NoAnswerError, self.batch_size, deadline_error=DeadlineExceeded,
+                                 item_errors=True)
+            results = []
+            for i, answers in engine.run(lines):
+                if isinstance(answers, Exception) and not isinstance(answers, DeadlineExceeded):
+                    traceback.print_exception(type(answers), answers, answers.__traceback__)
+                results.append(response_for(requests[int(i)].get('id', int(i)), answers))
+        return {'results': results}
+
+    def handle(self, request):
+        error = invalid(request)
+        if error is not None:
+            return {'error': BAD_REQUEST + error}
+        try:
+            if 'batch' in request:
+                return self.answer_batch(request['batch'])
+            return self.answer(request.get('id'), request['question'])
+        except Exception as err:
+            # every request gets a response, also when something outside a single question broke
+            traceback.print_exc()
+            return {'error': 'internal error: {!r}'.format(err)}
+
+
+class SocketHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        for line in self.rfile:
+            if not line.strip():
+                continue
+            try:
+                response = self.server.daemon.handle(json.loads(line))
+            except ValueError:
+                response = {'error': 'request is not valid json'}
+            self.wfile.write(json.dumps(response).encode('utf-8') + b'\n')
+            self.wfile.flush()
+
+
+class SocketServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path, daemon):
+        if os.path.exists(path):
+            os.unlink(path)
+        super().__init__(path, SocketHandler)
+        self.daemon = daemon
+
+
+def status(response):
+    if 'error' not in response:
+        return 200
+    return 400 if response['error'].startswith(BAD_REQUEST) else 500
+
+
+class HTTPHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        parts = urlsplit(self.path)
+        questions = parse_qs(parts.query).get('q')
+        if parts.path != '/answer' or not questions:
+            self.send_json(404, {'error': 'use GET /answer?q=<question>, POST /answer or POST /batch'})
+            return
+        response = self.server.daemon.answer(None, questions[0])
+        self.send_json(status(response), response)
+
+    def do_POST(self):
+        try:
+            request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+        except ValueError:
+            self.send_json(400, {'error': 'request is not valid json'})
+            return
+        if self.path == '/batch' and isinstance(request, list):
+            request = {'batch': request}
+        if self.path not in ('/answer', '/batch'):
+            self.send_json(404, {'error': 'use POST /answer or POST /batch'})
+            return
+        response = self.server.daemon.handle(request)
+        self.send_json(status(response), response)
+
+    def send_json(self, status, response):
+        body = json.dumps(response).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class HTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, daemon):
+        super().__init__(address, HTTPHandler)
+        self.daemon = daemon
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description='Keep the QA system loaded and answer questions over a socket')
+    arg_parser.add_argument('--socket', default=SOCKET_PATH, help='unix domain socket path (default %(default)s)')
+    arg_parser.add_argument('--port', type=int, default=HTTP_PORT,
+                            help='local http port, 0 to disable http (default %(default)s)')
+    arg_parser.add_argument('--batch-size', metavar='N', type=int, default=32,
+                            help='number of questions per nlp.pipe batch for batch requests')
+    add_solver_arguments(arg_parser)
+    args = arg_parser.parse_args()
+
+    print('Loading up QA System...')
+    qa_daemon = QADaemon(build_solver(args), args.batch_size)
+    servers = [SocketServer(args.socket, qa_daemon)]
+    if args.port:
+        servers.append(HTTPServer(('127.0.0.1', args.port), qa_daemon))
+    for server in servers[1:]:
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+    print('Ready to go! Listening on {}{}'.format(
+        args.socket, ' and http://127.0.0.1:{}'.format(args.port) if args.port else ''), file=sys.stderr)
+    try:
+        servers[0].serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for server in servers:
+            server.server_close()
+        save_solver_state(qa_daemon.qa_system)
+        os.unlink(args.socket)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,195 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# ensemble of the five question analysers in this repository on one shared spaCy Doc
+# every question is parsed once, then the QuestionParser of system.py and the extractors of s3135152.py,
+# s3225143.py, s3234045.py and s3254259.py all read the same Doc. their entity and property phrases are merged
+# and deduplicated before anything goes over the network, and resolved through the lookup layer of the
+# QuestionSolver (search cache, search/property index, deadline budget) and its candidate loop.
+#   python3 ensemble.py [solver options of system.py] < test_questions.txt     (writes answer_file.txt)
+
+import argparse
+import sys
+
+from itertools import zip_longest
+
+import s3135152
+import s3225143
+import s3234045
+import s3254259
+
+from budget import DeadlineExceeded
+from models import get_matcher
+from search_cache import normalize
+from system import NoAnswerError, add_solver_arguments, build_solver, print_solver_stats, save_solver_state, \
+    write_answers
+
+# the extractors in order of trust, the phrases of the first ones are tried first
+EXTRACTORS = ['system', 's3234045', 's3225143', 's3135152', 's3254259']
+
+# the question type for phrases that only the other extractors found: wd:entity wdt:property ?answer
+DEFAULT_TYPE = 'X_OF_Y'
+
+# what the extractors raise on a question they don't understand
+EXTRACT_ERRORS = (NoAnswerError, s3234045.NoAnswerError, StopIteration, IndexError, ValueError, UnboundLocalError)
+
+# at most this many wikidata ids per side, the same as the srlimit of a single search
+MAX_IDS = 5
+
+
+class Ensemble:
+    def __init__(self, qa_system):
+        self.qa_system = qa_system
+        self.parser = qa_system.parser
+        # every matcher is built against the shared model, so it can read the shared Doc
+        self.matchers = {
+            's3225143': get_matcher('en', 's3225143', s3225143.make_matcher),
+            's3234045': get_matcher('en', 's3234045', s3234045.QuestionSolver.init_matcher),
+            's3254259': get_matcher('en', 's3254259', s3254259.make_matcher),
+        }
+        self.questions = 0
+        self.phrases = 0
+        self.lookups = 0
+        self.contributed = dict.fromkeys(EXTRACTORS, 0)
+        self.failed = dict.fromkeys(EXTRACTORS, 0)
+
+    # (question type, extra, entity phrases, property phrases) of every extractor that understood the Doc
+    def extract(self, doc):
+        found = {}
+        for name in EXTRACTORS:
+            try:
+                found[name] = getattr(self, 'extract_' + name)(doc)
+            except EXTRACT_ERRORS:
+                pass
+            except Exception:
+                # an extractor that breaks on an unexpected Doc only loses its own phrases
+                self.failed[name] += 1
+        return found
+
+    def extract_system(self, doc):
+        q_type, ent, prop, extra = self.parser.parse_doc(doc)
+        return q_type, extra, [ent], [prop]
+
+    def extract_s3234045(self, doc):
+        prop, entity = s3234045.QuestionSolver.parse_doc(doc, self.matchers['s3234045'])
+        return None, None, [entity], [prop]
+
+    def extract_s3225143(self, doc):
+        return None, None, s3225143.entity_names(doc), s3225143.attribute_names(doc, self.matchers['s3225143'])
+
+    @staticmethod
+    def extract_s3135152(doc):
+        properties, entities = s3135152.questionmaker([], [], doc)
+        return None, None, entities, properties
+
+    def extract_s3254259(self, doc):
+        entity, properties = s3254259.extract(doc, self.matchers['s3254259'])
+        return None, None, [entity], properties
+
+    # the merged and deduplicated phrases in extractor order, and the question type of system.py if it had one
+    def candidates(self, question):
+        question = self.parser.prepare(question)
+        with self.parser.timer.stage('parse'):
+            doc = self.parser.nlp(question)
+        found = self.extract(doc)
+
+        q_type, extra = DEFAULT_TYPE, None
+        if 'system' in found:
+            q_type, extra = found['system'][:2]
+        entities, properties = {}, {}
+        for name in EXTRACTORS:
+            if name not in found:
+                continue
+            _, _, ents, props = found[name]
+            contributed = False
+            for phrases, merged in ((ents, entities), (props, properties)):
+                for phrase in phrases:
+                    key = normalize(phrase) if phrase else ''
+                    if not key:
+                        continue
+                    self.phrases += 1
+                    contributed = True
+                    merged.setdefault(key, phrase)
+            self.contributed[name] += contributed
+        return q_type, extra, list(entities.values()), list(properties.values())
+
+    # the best wikidata ids of every phrase first, then the second best, ...
+    def lookup(self, phrases, prop_search, budget):
+        results = []
+        for phrase in phrases:
+            self.lookups += 1
+            results.append(self.qa_system.query_wikidata_api(phrase, prop_search, budget) or [])
+        ids = {}
+        for rank in zip_longest(*results):
+            for wikidata_id in rank:
+                if wikidata_id is not None:
+                    ids.setdefault(wikidata_id)
+        return list(ids)[:MAX_IDS]
+
+    def __call__(self, question):
+        qa_system = self.qa_system
+        with qa_system.timer.stage('question', question=question):
+            self.questions += 1
+            budget = qa_system.new_budget()
+            q_type, extra, entities, properties = self.candidates(question)
+            if not entities:
+                raise NoAnswerError('Could not find the entity you asked about')
+
+            wikidata_entities = self.lookup(entities, False, budget)
+            wikidata_props = ['']
+            if qa_system.batch_uses_prop(q_type):
+                wikidata_props = self.lookup(properties, True, budget)
+            extra = qa_system.query_wikidata_api(extra, False, budget)[0] if extra is not None else ''
+            if not wikidata_props:
+                raise NoAnswerError('Could not find the property you asked for')
+            if not wikidata_entities:
+                raise NoAnswerError('Could not find the entity you asked about')
+
+            candidates = [(e, p) for e in wikidata_entities for p in wikidata_props]
+            return qa_system.execute(q_type, candidates, extra, budget)
+
+    def stats(self):
+        return {
+            'questions':   self.questions,
+            'phrases':     self.phrases,
+            'lookups':     self.lookups,
+            'contributed': dict(self.contributed),
+            'failed':      dict(self.failed),
+        }
+
+    def print_stats(self, file):
+        stats = self.stats()
+        print('Ensemble: {questions} questions parsed once, {phrases} phrases from the extractors, {lookups} '
+              'lookups after deduplication'.format(**stats), file=file)
+        print('Extractors with phrases: ' + ', '.join('{} {}'.format(name, count)
+                                                      for name, count in stats['contributed'].items()), file=file)
+        if any(stats['failed'].values()):
+            print('Extractors that failed: ' + ', '.join(
+                '{} {}'.format(name, count) for name, count in stats['failed'].items() if count), file=file)
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description='Answer questions from standard input with all five analysers')
+    add_solver_arguments(arg_parser)
+    args = arg_parser.parse_args()
+    print('Loading up QA System...')
+    ensemble = Ensemble(build_solver(args))
+    print('Ready to go!\n')
+    with open('answer_file.txt', 'w') as answer_file:
+        for question in sys.stdin:
+            q_id, q = question.strip().split('\t')
+            try:
+                answers_current = ensemble(q)
+            except NoAnswerError:
+                answers_current = None
+            except DeadlineExceeded as err:
+                answers_current = err
+            write_answers(answer_file, q_id, answers_current)
+
+    save_solver_state(ensemble.qa_system)
+    ensemble.print_stats(sys.stderr)
+    print_solver_stats(ensemble.qa_system, sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
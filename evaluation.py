@@ -0,0 +1,214 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# incremental, parallel accuracy evaluation for the QuestionSolver of system2.py
+# the result of every gold question is stored with a fingerprint of what it depends on: the shared parser and
+# solver code (matcher patterns, translation, search, answer formatting, spaCy model), the handler of its
+# question type and its query template. the next run parses every question again (cheap with the parse cache),
+# reuses the results whose fingerprint didn't change and sends only the others to wikidata, several at a time.
+#   python3 system2.py all_questions_and_answers.tsv --results eval_results.json --workers 8
+
+import hashlib
+import inspect
+import json
+import os
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+
+import answers
+
+from rate_limit import Throttled
+
+
+def source(value):
+    if isinstance(value, (staticmethod, classmethod)):
+        value = value.__func__
+    if inspect.isfunction(value):
+        return inspect.getsource(value)
+    if isinstance(value, (set, frozenset)):
+        return repr(sorted(value))
+    if isinstance(value, dict):
+        return repr(sorted(value.items()))
+    return repr(value)
+
+
+def digest(*parts):
+    hasher = hashlib.sha1()
+    for part in parts:
+        hasher.update(part.encode('utf-8'))
+        hasher.update(b'\0')
+    return hasher.hexdigest()[:16]
+
+
+class Fingerprints:
+    def __init__(self, qa_system):
+        parser = qa_system.parser
+        handlers = {q_type.lower() for q_type in qa_system.query_dict}
+        parts = []
+        for cls in (type(parser), type(qa_system)):
+            for name, value in sorted(vars(cls).items()):
+                # the handlers and the query templates (in QuestionSolver.__init__) are fingerprinted per type
+                if name in handlers or (cls is type(qa_system) and name == '__init__'):
+                    continue
+                if name.startswith('__') and not inspect.isfunction(value):
+                    continue
+                parts.append('{}.{}={}'.format(cls.__name__, name, source(value)))
+        meta = getattr(parser.nlp, 'meta', {})
+        model = '{}_{}-{}'.format(meta.get('lang'), meta.get('name'), meta.get('version'))
+        parts += [inspect.getsource(answers), model, qa_system.sparql_url, qa_system.wiki_api_url]
+        self.shared = digest(*parts)
+        self.by_type = {}
+        for q_type, template in qa_system.query_dict.items():
+            handler = inspect.getattr_static(type(parser), q_type.lower())
+            self.by_type[q_type] = digest(self.shared, source(handler), template)
+
+    # questions the parser rejected only depend on the shared code
+    def __call__(self, q_type):
+        return self.by_type.get(q_type, self.shared) if q_type is not None else self.shared
+
+
+class ResultStore:
+    def __init__(self, path, max_age=7 * 24 * 3600):
+        self.path = path
+        # wikidata changes as well, so old results are recomputed after max_age seconds
+        self.max_age = max_age
+        self.results = {}
+        self.summary = None
+        if path is not None and os.path.exists(path):
+            with open(path) as results_file:
+                data = json.load(results_file)
+            self.results = data['results']
+            self.summary = data['summary']
+
+    def get(self, question, fingerprint):
+        record = self.results.get(question)
+        if record is None or record['fingerprint'] != fingerprint or time.time() - record['created'] > self.max_age:
+            return None
+        # a question that wikidata throttled says nothing about the code, it is asked again
+        if record.get('throttled'):
+            return None
+        return record
+
+    # the records of this run, per question text
+    def save(self, questions, records, summary):
+        if self.path is None:
+            return
+        results = {question: {key: value for key, value in record.items() if key != 'cached'}
+                   for (question, _), record in zip(questions, records)}
+        with open(self.path + '.tmp', 'w') as results_file:
+            json.dump({'summary': summary, 'results': results}, results_file, indent=1, sort_keys=True)
+        os.replace(self.path + '.tmp', self.path)
+
+
+# the same rule as before: at least half of our answers are gold answers
+def is_correct(found, gold):
+    if not found:
+        return False
+    return sum(1 for answer in found if answer.strip() in gold) / len(found) >= 0.5
+
+
+class Evaluation:
+    # reuse=False answers every question again, but still compares with the previous run
+    def __init__(self, qa_system, no_answer_error, store, workers=8, reuse=True):
+        self.qa_system = qa_system
+        self.no_answer_error = no_answer_error
+        self.store = store
+        self.workers = workers
+        self.reuse = reuse
+        self.fingerprints = Fingerprints(qa_system)
+
+    # questions is a list of (question, gold answers), returns a record per question in the same order
+    def run(self, questions):
+        records = [None] * len(questions)
+        jobs = []
+        # parsing stays in this thread, only the wikidata lookups run in parallel
+        for index, (question, gold) in enumerate(questions):
+            start = time.perf_counter()
+            try:
+                parsed = self.qa_system.parser(question)
+            except self.no_answer_error as err:
+                parsed = err
+            parse_time = time.perf_counter() - start
+            fingerprint = self.fingerprints(None if isinstance(parsed, Exception) else parsed[0])
+            record = self.store.get(question, fingerprint) if self.reuse else None
+            if record is not None:
+                # the gold answers can have been corrected since, they are not part of the fingerprint
+                records[index] = dict(record, cached=True, correct=is_correct(record['answers'], gold))
+            else:
+                jobs.append((index, gold, parsed, parse_time, fingerprint))
+
+        with ThreadPoolExecutor(max_workers=max(1, self.workers)) as pool:
+            for index, record in pool.map(self.answer, jobs):
+                records[index] = record
+        return records
+
+    def answer(self, job):
+        index, gold, parsed, parse_time, fingerprint = job
+        start = time.perf_counter()
+        found, error, throttled = None, None, False
+        try:
+            if isinstance(parsed, Exception):
+                raise parsed
+            q_type, ent, prop, extra = parsed
+            if ent is None and prop is None:
+                raise self.no_answer_error
+            found = [str(answer) for answer in self.qa_system.query_answer(q_type, ent, prop, extra)]
+        except self.no_answer_error as err:
+            error = str(err)
+        except Throttled as err:
+            error, throttled = str(err), True
+        return index, {
+            'fingerprint': fingerprint,
+            'created':     time.time(),
+            'answers':     found,
+            'error':       error,
+            'throttled':   throttled,
+            'correct':     is_correct(found, gold),
+            'latency':     parse_time + time.perf_counter() - start,
+            'cached':      False,
+        }
+
+
+def summarize(records):
+    correct = sum(1 for record in records if record['correct'])
+    return {
+        'questions': len(records),
+        'correct':   correct,
+        'accuracy':  correct / len(records) if records else 0.0,
+    }
+
+
+# accuracy against the previous run, the questions that changed and the biggest latency changes
+def print_report(questions, records, store, file, show=10):
+    summary = summarize(records)
+    print('Accuracy: ', summary['accuracy'], file=file)
+    recomputed = sum(1 for record in records if not record['cached'])
+    print('{} questions reused, {} recomputed'.format(len(records) - recomputed, recomputed), file=file)
+    if store.summary is None:
+        return summary
+
+    print('Previous run: {:.4f} ({:+.4f})'.format(store.summary['accuracy'],
+                                                 summary['accuracy'] - store.summary['accuracy']), file=file)
+    fixed, broken, deltas = [], [], []
+    for (question, _), record in zip(questions, records):
+        previous = store.results.get(question)
+        if previous is None or record['cached']:
+            continue
+        if record['correct'] and not previous['correct']:
+            fixed.append(question)
+        elif previous['correct'] and not record['correct']:
+            broken.append(question)
+        deltas.append((record['latency'] - previous['latency'], previous['latency'], record['latency'], question))
+    for label, changed in (('Now correct', fixed), ('No longer correct', broken)):
+        if changed:
+            print('{} ({}):'.format(label, len(changed)), file=file)
+            for question in changed:
+                print('  ' + question, file=file)
+    if deltas:
+        print('Latency of the {} recomputed questions: {:+.1f} ms on average'.format(
+            len(deltas), 1000 * sum(delta[0] for delta in deltas) / len(deltas)), file=file)
+        for delta, old, new, question in sorted(deltas, key=lambda delta: -abs(delta[0]))[:show]:
+            print('  {:+8.1f} ms ({:.1f} -> {:.1f} ms)  {}'.format(1000 * delta, 1000 * old, 1000 * new, question),
+                  file=file)
+    return summary
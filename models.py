@@ -0,0 +1,75 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# process-wide registry of the spaCy pipelines and Matchers used by the QA scripts
+# a pipeline is loaded the first time it is asked for and then shared, and every Matcher is built once
+# against its pipeline, so all parsers in a process use the same instances and no question reloads a model
+#
+#   nlp = get_model('en')
+#   matcher = get_matcher('en', 's3225143', make_matcher)     # make_matcher(nlp) builds the Matcher
+
+import os
+import resource
+import sys
+import threading
+import time
+
+import spacy
+
+_models = {}
+_matchers = {}
+_loads = {}
+_lock = threading.RLock()
+
+
+def rss_bytes():
+    # current resident set size, from /proc on linux and the peak size elsewhere
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def get_model(name='en'):
+    with _lock:
+        nlp = _models.get(name)
+        if nlp is None:
+            rss = rss_bytes()
+            start = time.perf_counter()
+            nlp = _models[name] = spacy.load(name)
+            _loads[name] = (time.perf_counter() - start, rss_bytes() - rss)
+        return nlp
+
+
+def get_matcher(model, key, build):
+    with _lock:
+        matcher = _matchers.get((model, key))
+        if matcher is None:
+            matcher = _matchers[model, key] = build(get_model(model))
+        return matcher
+
+
+def memory_report():
+    with _lock:
+        report = []
+        for name, nlp in _models.items():
+            seconds, rss = _loads[name]
+            vectors = nlp.vocab.vectors.data.nbytes if nlp.vocab.vectors.data is not None else 0
+            report.append({
+                'model':    name,
+                'seconds':  seconds,
+                'rss':      rss,
+                'vocab':    len(nlp.vocab),
+                'vectors':  vectors,
+                'matchers': sum(1 for model, _ in _matchers if model == name),
+            })
+        return report
+
+
+def print_memory(file):
+    for model in memory_report():
+        print('spaCy model {model}: loaded in {seconds:.1f}s, +{rss_mb:.0f} MB resident ({vectors_mb:.0f} MB vectors), '
+              '{vocab} lexemes, {matchers} matchers'.format(rss_mb=model['rss'] / 2 ** 20,
+                                                          vectors_mb=model['vectors'] / 2 ** 20, **model), file=file)
@@ -0,0 +1,69 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# negative cache for QuestionSolver: remembers that wd:Q wdt:P ?answer has no value at all
+# (a disambiguation page, or a property the entity doesn't have), so the candidate loop can skip the pair
+# without asking the SPARQL endpoint again. pairs are packed into a single int and kept in two generations
+# of sets: every ttl / 2 the older generation is dropped, so a pair is remembered between ttl / 2 and ttl.
+
+import threading
+import time
+
+# property ids stay far below 2 ** 24, the entity number goes in the bits above them
+PROP_BITS = 24
+
+
+def pack(entity, prop):
+    # None for anything that is not a plain Q/P id pair (lexemes, empty properties, ...)
+    if entity[:1] != 'Q' or prop[:1] != 'P' or not entity[1:].isdigit() or not prop[1:].isdigit():
+        return None
+    return int(entity[1:]) << PROP_BITS | int(prop[1:])
+
+
+class NegativeCache:
+    def __init__(self, ttl=6 * 3600):
+        self.ttl = ttl
+        self.current = set()
+        self.previous = set()
+        self.rotated = time.time()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.current | self.previous)
+
+    def rotate(self):
+        now = time.time()
+        if now - self.rotated >= self.ttl / 2:
+            # after a whole ttl without a rotation both generations are too old
+            self.previous = self.current if now - self.rotated < self.ttl else set()
+            self.current = set()
+            self.rotated = now
+
+    def known_empty(self, entity, prop):
+        pair = pack(entity, prop)
+        if pair is None:
+            return False
+        with self.lock:
+            self.rotate()
+            if pair in self.current or pair in self.previous:
+                self.hits += 1
+                return True
+            self.misses += 1
+            return False
+
+    def add(self, entity, prop):
+        pair = pack(entity, prop)
+        if pair is not None:
+            with self.lock:
+                self.rotate()
+                self.current.add(pair)
+
+    def stats(self):
+        with self.lock:
+            return {
+                'pairs':  len(self),
+                'hits':   self.hits,
+                'misses': self.misses,
+            }
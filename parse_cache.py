@@ -0,0 +1,158 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# LRU cache for QuestionParser: the parsed Doc and the handler output (q_type, entity, property, extra)
+# of every question, keyed by the normalized question text
+# with a path the Docs are also stored in a spaCy DocBin file, so later runs (evaluation over the gold
+# files, benchmarks) don't need to run the parser at all for questions they have seen before
+# Docs of the fast path (parsed without the dependency parser, see prefilter.py) are only handed out to callers
+# that don't need the parser, and are never written to the DocBin file that system2.py may share
+
+import os
+import threading
+
+from collections import OrderedDict
+
+from spacy.tokens import DocBin
+
+# there is no cached handler output for this question (yet), same sentinel as the search cache
+from search_cache import MISS
+
+# the token attributes used by the Matcher patterns and the parser functions
+DOC_ATTRS = ['ORTH', 'TAG', 'POS', 'LEMMA', 'DEP', 'HEAD', 'ENT_IOB', 'ENT_TYPE']
+
+
+def normalize(question):
+    # only the whitespace, casing matters to the tagger and the NER
+    return ' '.join(question.split())
+
+
+# every token of a Doc that went through the dependency parser has a dependency label
+def has_parse(doc):
+    return all(token.dep for token in doc)
+
+
+class Entry:
+    __slots__ = ('doc', 'parsed', 'result')
+
+    def __init__(self, doc, parsed=True):
+        self.doc = doc
+        self.parsed = parsed
+        self.result = MISS
+
+
+class ParseCache:
+    def __init__(self, vocab, max_entries=1024, path=None):
+        self.vocab = vocab
+        self.max_entries = max_entries
+        self.path = path
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # number of Docs that are not in the DocBin file yet
+        self.added = 0
+        self.lock = threading.Lock()
+        if path is not None and os.path.exists(path):
+            self.load()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def lookup(self, key):
+        entry = self.entries.get(key)
+        if entry is not None:
+            self.entries.move_to_end(key)
+        return entry
+
+    # needs_parser=False also accepts a Doc that was parsed without the dependency parser
+    def get_doc(self, question, needs_parser=True):
+        with self.lock:
+            entry = self.lookup(normalize(question))
+            if entry is None or (needs_parser and not entry.parsed):
+                return None
+            return entry.doc
+
+    # parsed tells whether the dependency parser ran, a full Doc replaces a fast path Doc of the same question
+    def put_doc(self, question, doc, parsed=True):
+        with self.lock:
+            key = normalize(question)
+            entry = self.entries.get(key)
+            if entry is None:
+                self.entries[key] = Entry(doc, parsed)
+                self.added += parsed
+                self.evict()
+            elif parsed and not entry.parsed:
+                entry.doc, entry.parsed = doc, True
+                self.added += 1
+
+    # the handler output of the question, or the NoAnswerError it raised
+    def get_result(self, question):
+        with self.lock:
+            entry = self.lookup(normalize(question))
+            if entry is None or entry.result is MISS:
+                self.misses += 1
+                return MISS
+            self.hits += 1
+            return entry.result
+
+    def put_result(self, question, result):
+        with self.lock:
+            entry = self.lookup(normalize(question))
+            if entry is not None:
+                entry.result = result
+
+    # drop the least recently used entries until we are back under max_entries
+    def evict(self):
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def load(self):
+        with open(self.path, 'rb') as doc_file:
+            self.merge(doc_file.read())
+        self.added = 0
+
+    # adds the Docs of a DocBin (the file, or the cache of a batch_runner.py worker) that are not cached yet
+    def merge(self, data):
+        doc_bin = DocBin(attrs=DOC_ATTRS).from_bytes(data)
+        with self.lock:
+            for doc in doc_bin.get_docs(self.vocab):
+                key = normalize(doc.text)
+                # files of older versions can still contain fast path Docs
+                if key not in self.entries and has_parse(doc):
+                    self.entries[key] = Entry(doc)
+                    self.added += 1
+            self.evict()
+
+    # the fully parsed Docs as a DocBin
+    def to_bytes(self):
+        with self.lock:
+            doc_bin = DocBin(attrs=DOC_ATTRS)
+            for entry in self.entries.values():
+                if entry.parsed:
+                    doc_bin.add(entry.doc)
+        return doc_bin.to_bytes()
+
+    def save(self):
+        if self.path is None or not self.added:
+            return
+        data = self.to_bytes()
+        self.added = 0
+        # write next to the old file first, so an interrupted run doesn't leave half a DocBin behind
+        with open(self.path + '.tmp', 'wb') as doc_file:
+            doc_file.write(data)
+        os.replace(self.path + '.tmp', self.path)
+
+    def hit_ratio(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def stats(self):
+        return {
+            'entries':   len(self),
+            'hits':      self.hits,
+            'misses':    self.misses,
+            'evictions': self.evictions,
+            'hit_ratio': self.hit_ratio(),
+        }
@@ -0,0 +1,215 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# pipelined batch engine for the QuestionSolver in system.py
+# the stages (parse with nlp.pipe, entity/property resolution, SPARQL execution and writing)
+# run in their own threads and are connected by bounded queues, so they overlap
+# every question has its own context (contextvars) with its 'question' stage open from parsing until it is
+# written, the stages run their work for the question in that context (see tracing.py)
+
+import contextvars
+import threading
+import time
+
+from queue import Queue
+
+# marks the end of the input on a queue
+END = None
+
+
+class Item:
+    __slots__ = ('index', 'q_id', 'value', 'error', 'context', 'stage')
+
+    def __init__(self, index, q_id, value, timer):
+        self.index = index
+        self.q_id = q_id
+        self.value = value
+        self.error = None
+        self.context = contextvars.copy_context()
+        self.stage = timer.stage('question', question=value)
+        self.context.run(self.stage.__enter__)
+
+    def finish(self):
+        error = self.error
+        self.context.run(self.stage.__exit__, type(error) if error is not None else None, error,
+                         error.__traceback__ if error is not None else None)
+
+
+class StageStats:
+    def __init__(self, name):
+        self.name = name
+        self.items = 0
+        self.busy = 0.0
+        self.lock = threading.Lock()
+
+    def add(self, items, seconds):
+        with self.lock:
+            self.items += items
+            self.busy += seconds
+
+    def throughput(self):
+        return self.items / self.busy if self.busy else 0.0
+
+
+class Stage:
+    def __init__(self, name, func, inbox, outbox, workers):
+        self.func = func
+        self.inbox = inbox
+        self.outbox = outbox
+        self.stats = StageStats(name)
+        self.running = workers
+        self.lock = threading.Lock()
+        self.threads = [threading.Thread(target=self.work, name=name, daemon=True) for _ in range(workers)]
+
+    def start(self):
+        for thread in self.threads:
+            thread.start()
+
+    def work(self):
+        while True:
+            item = self.inbox.get()
+            if item is END:
+                # let the other workers of this stage see the end as well, the last one passes it on
+                self.inbox.put(END)
+                with self.lock:
+                    self.running -= 1
+                    if self.running == 0:
+                        self.outbox.put(END)
+                return
+
+            if item.error is None:
+                start = time.perf_counter()
+                try:
+                    item.value = item.context.run(self.func, item.value)
+                except Exception as err:
+                    # handed to the writer, which decides if this is just a missing answer
+                    item.error = err
+                self.stats.add(1, time.perf_counter() - start)
+            self.outbox.put(item)
+
+
+class BatchEngine:
+    def __init__(self, qa_system, no_answer_error, batch_size=32, queue_size=64, workers=1, deadline_error=None,
+                 item_errors=False):
+        self.qa_system = qa_system
+        self.parser = qa_system.parser
+        self.no_answer_error = no_answer_error
+        # questions cut off by their deadline are yielded with the error instead of None
+        self.deadline_error = deadline_error
+        # with item_errors any other error is yielded for its own question too, instead of ending the run
+        self.item_errors = item_errors
+        self.batch_size = batch_size
+        self.queue_size = queue_size
+        self.workers = workers
+        self.parse_stats = StageStats('parse')
+        self.write_stats = StageStats('write')
+        self.stages = []
+        self.wall_time = 0.0
+        self.parse_error = None
+
+    def resolve(self, parsed):
+        q_type, ent, prop, extra = parsed
+        if ent is None and prop is None:
+            raise self.no_answer_error
+        # the deadline and call budget of a question cover both the resolve and the SPARQL stage
+        budget = self.qa_system.new_budget()
+        return (q_type,) + self.qa_system.resolve(ent, prop, extra, budget) + (budget,)
+
+    def execute(self, resolved):
+        return self.qa_system.execute(*resolved)
+
+    def parse(self, lines, outbox):
+        items = []
+        try:
+            for index, line in enumerate(lines):
+                q_id, q = line.strip().split('\t')
+                items.append(Item(index, q_id, self.parser.prepare(q), self.qa_system.timer))
+                if len(items) == self.batch_size:
+                    self.parse_batch(items, outbox)
+                    items = []
+            if items:
+                self.parse_batch(items, outbox)
+        except Exception as err:
+            self.parse_error = err
+        finally:
+            outbox.put(END)
+
+    def parse_batch(self, items, outbox):
+        start = time.perf_counter()
+        # questions that are in the parse cache skip nlp.pipe
+        try:
+            # only nlp.pipe runs for the whole batch, the rest of parsing runs in the context of each question
+            results = self.parser.parse_many([item.value for item in items], self.batch_size,
+                                             [item.context for item in items])
+        except Exception:
+            if not self.item_errors:
+                raise
+            # find the question that broke the batch
+            results = [self.parse_one(item) for item in items]
+        for item, result in zip(items, results):
+            if isinstance(result, Exception):
+                item.error = result
+            else:
+                item.value = result
+        self.parse_stats.add(len(items), time.perf_counter() - start)
+        for item in items:
+            outbox.put(item)
+
+    def parse_one(self, item):
+        try:
+            return self.parser.parse_many([item.value], 1, [item.context])[0]
+        except Exception as err:
+            return err
+
+    # yields (q_id, answers) in input order, answers is None when no answer was found
+    # and the deadline error when the question ran out of time or remote calls (or any error with item_errors)
+    def run(self, lines):
+        start = time.perf_counter()
+        parsed, resolved, answered = (Queue(self.queue_size) for _ in range(3))
+        self.stages = [
+            Stage('resolve', self.resolve, parsed, resolved, self.workers),
+            Stage('sparql', self.execute, resolved, answered, self.workers),
+        ]
+        for stage in self.stages:
+            stage.start()
+        reader = threading.Thread(target=self.parse, args=(lines, parsed), name='parse', daemon=True)
+        reader.start()
+
+        # buffer results that finish early until all questions before them are done
+        pending = {}
+        next_index = 0
+        while True:
+            item = answered.get()
+            if item is END:
+                break
+            pending[item.index] = item
+            while next_index in pending:
+                item = pending.pop(next_index)
+                next_index += 1
+                item.finish()
+                if item.error is not None and not isinstance(item.error, self.no_answer_error):
+                    if not self.item_errors and (self.deadline_error is None or
+                                                 not isinstance(item.error, self.deadline_error)):
+                        raise item.error
+                write_start = time.perf_counter()
+                answers = item.value
+                if item.error is not None:
+                    answers = None if isinstance(item.error, self.no_answer_error) else item.error
+                yield item.q_id, answers
+                self.write_stats.add(1, time.perf_counter() - write_start)
+        reader.join()
+        if self.parse_error is not None:
+            raise self.parse_error
+        self.wall_time = time.perf_counter() - start
+
+    def stats(self):
+        return [self.parse_stats] + [stage.stats for stage in self.stages] + [self.write_stats]
+
+    def print_stats(self, file):
+        print('{:<10}{:>8}{:>12}{:>12}'.format('stage', 'items', 'busy (s)', 'items/s'), file=file)
+        for stats in self.stats():
+            print('{:<10}{:>8}{:>12.3f}{:>12.1f}'.format(stats.name, stats.items, stats.busy, stats.throughput()),
+                  file=file)
+        if self.wall_time:
+            print('{} questions in {:.3f}s ({:.1f} questions/s)'.format(
+                self.write_stats.items, self.wall_time, self.write_stats.items / self.wall_time), file=file)
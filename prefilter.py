@@ -0,0 +1,54 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# lexical prefilter for QuestionParser, runs before the tagger, parser and NER
+# question types that are decided by their first two words get their type right away, so they skip the
+# Matcher (and the dependency parser, when their parser function doesn't look at dependencies).
+# questions without any word that one of the Matcher patterns can start with are rejected right away.
+# DID_X and FROM_WHICH_X need the dependency labels and POS tags of the words after the keyword,
+# so they always take the full path.
+
+import re
+import threading
+
+# the question can't match any of the Matcher patterns
+REJECT = 'REJECT'
+
+FAST_PATHS = [
+    # question type, regex on the start of the question, does the parser function need the dependency parse
+    ('HOW_MANY_X',    re.compile(r'how\s+many\b', re.IGNORECASE),           True),
+    ('WHEN_DID_WAS',  re.compile(r'when\s+(?:did|was)\b', re.IGNORECASE),  False),
+    ('WHERE_DID_WAS', re.compile(r'where\s+(?:did|was)\b', re.IGNORECASE), False),
+    ('HOW_DID',       re.compile(r'how\s+did\b', re.IGNORECASE),            False),
+]
+
+# every Matcher pattern starts with one of these words or with a determiner
+START_WORDS = {'who', 'what', 'when', 'where', 'how', 'did', 'does', 'from'}
+DETERMINERS = {'a', 'an', 'the', 'this', 'that', 'these', 'those', 'which', 'whose', 'some', 'any', 'all', 'each',
+               'every', 'no', 'another', 'either', 'neither', 'both', 'whatever', 'whichever'}
+ANCHOR_WORDS = START_WORDS | DETERMINERS
+WORD = re.compile(r'[a-z]+')
+
+
+class Prefilter:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counts = {'fast': 0, 'full': 0, 'rejected': 0}
+
+    # returns (question type, dependency parse needed), the type is None when the Matcher has to decide
+    def __call__(self, question):
+        for q_type, pattern, needs_parser in FAST_PATHS:
+            if pattern.match(question):
+                return self.count('fast', q_type, needs_parser)
+        if ANCHOR_WORDS.isdisjoint(WORD.findall(question.lower())):
+            return self.count('rejected', REJECT, False)
+        return self.count('full', None, True)
+
+    def count(self, path, q_type, needs_parser):
+        with self.lock:
+            self.counts[path] += 1
+        return q_type, needs_parser
+
+    def stats(self):
+        with self.lock:
+            return dict(self.counts)
@@ -0,0 +1,119 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# offline lookup of property phrases for QuestionSolver.query_wikidata_api(prop, True)
+# maps the normalized english labels and aliases of all properties, and every phrase translate_query can
+# produce (trans_dict outputs such as "birth" or "director", "date of birth", "has part", ...), to a ranked
+# list of property ids. a phrase that is not in the index still goes to the search api.
+#
+# build the index from a wikidata property dump (entity JSON, one property per line) with:
+#   python3 property_index.py properties.json properties.idx
+
+import json
+import sys
+
+from search_cache import normalize
+
+# at most this many property ids per phrase, like srlimit in the search api
+LIMIT = 5
+
+
+def read_property_json(lines, language='en'):
+    # yields (id, label, [aliases]) per property
+    for line in lines:
+        line = line.strip().rstrip(',')
+        if not line or line in ('[', ']'):
+            continue
+        entity = json.loads(line)
+        if not entity['id'].startswith('P'):
+            continue
+        label = entity.get('labels', {}).get(language, {}).get('value')
+        aliases = [alias['value'] for alias in entity.get('aliases', {}).get(language, [])]
+        yield entity['id'], label, aliases
+
+
+def parser_phrases():
+    # everything translate_query can turn a property into, besides the words of the question itself
+    from system import QuestionParser
+    phrases = set(QuestionParser.trans_dict.values())
+    for query in (['when', 'bear'], ['where', 'bear'], ['when', 'die'], ['where', 'die'], ['who', 'direct'],
+                  ['when', 'direct'], ['who', 'publish'], ['when', 'publish'], ['where', 'live'], ['where', 'from'],
+                  ['real', 'name'], ['members']):
+        phrases.add(QuestionParser.translate_query(query))
+    return phrases
+
+
+def build(properties, path, phrases=()):
+    # (rank, phrase length, id): labels before aliases, the shortest phrase first
+    ranked = {}
+    names = []
+    for pid, label, aliases in properties:
+        for rank, name in [(0, label)] + [(1, alias) for alias in aliases]:
+            if not name:
+                continue
+            name = normalize(name)
+            ranked.setdefault(name, []).append((rank, len(name), int(pid[1:])))
+            names.append((rank, len(name), int(pid[1:]), set(name.split())))
+
+    # phrases that are not a label or alias get the properties that contain all of their words,
+    # "birth" becomes date of birth, place of birth, ...
+    for phrase in phrases:
+        phrase = normalize(phrase)
+        if phrase in ranked:
+            continue
+        words = set(phrase.split())
+        matches = [(rank, length, pid) for rank, length, pid, name_words in names if words <= name_words]
+        if matches:
+            ranked[phrase] = matches
+
+    index = {}
+    for phrase, matches in ranked.items():
+        pids = []
+        for _, _, pid in sorted(matches):
+            if 'P{}'.format(pid) not in pids:
+                pids.append('P{}'.format(pid))
+        index[phrase] = ' '.join(pids[:LIMIT])
+    with open(path, 'w', encoding='utf-8') as index_file:
+        json.dump(index, index_file, ensure_ascii=False, separators=(',', ':'), sort_keys=True)
+    return len(index)
+
+
+class PropertyIndex:
+    def __init__(self, path):
+        with open(path, encoding='utf-8') as index_file:
+            self.index = json.load(index_file)
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.index)
+
+    # ranked property ids for the phrase, None if the phrase is not in the index
+    def lookup(self, phrase):
+        pids = self.index.get(normalize(phrase))
+        if pids is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return pids.split()
+
+    def stats(self):
+        return {
+            'phrases': len(self),
+            'hits':    self.hits,
+            'misses':  self.misses,
+        }
+
+
+def main():
+    if len(sys.argv) != 3:
+        print('Usage: python3 property_index.py <properties.json> <output.idx>', file=sys.stderr)
+        sys.exit(1)
+    source, path = sys.argv[1:]
+    with open(source, encoding='utf-8') as source_file:
+        n_phrases = build(read_property_json(source_file), path, parser_phrases())
+    print('Indexed {} property phrases into {}'.format(n_phrases, path))
+
+
+if __name__ == '__main__':
+    main()
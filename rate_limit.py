@@ -0,0 +1,252 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# client-side rate control for the wikidata search api and the sparql endpoint
+# every host gets a token bucket (requests per second) and an AIMD window (requests in flight): each answered
+# request raises the rate and the window a little, every 429 or 503 halves them. a Retry-After header blocks
+# the host until then, and throttled requests are retried after a jittered exponential backoff.
+# with a per-question budget (budget.py) no wait goes past its deadline and every retry is one of its calls.
+# transport.py and async_http.py share one RateLimiter per process, replay.py uses TokenBucket to simulate
+# throttling (python3 replay.py fixtures.sqlite --throttle-rate 5).
+
+import asyncio
+import random
+import threading
+import time
+
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
+
+# the status codes the wikidata endpoints use to tell a client to slow down
+THROTTLED = {429, 503}
+
+# the rate and window are only halved once per this many seconds, a burst of 429s is one signal
+DECREASE_INTERVAL = 1.0
+
+
+class Throttled(Exception):
+    def __init__(self, url, status):
+        super().__init__('{} is still throttled (HTTP {}) after all retries'.format(url, status))
+        self.status = status
+
+
+class TokenBucket:
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.burst = burst if burst is not None else max(1.0, rate)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+
+    def refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    # takes a token and returns 0, or returns the seconds until the next token (the caller holds the lock)
+    def take(self, now=None):
+        self.refill(time.monotonic() if now is None else now)
+        if self.tokens >= 1.0:
+            self.tokens -= 1.0
+            return 0.0
+        return (1.0 - self.tokens) / self.rate
+
+
+# seconds to wait from a Retry-After header, which is either a number of seconds or an http date
+def retry_after(value, now=None):
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = parsedate_to_datetime(value).timestamp()
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, when - (time.time() if now is None else now))
+
+
+# full jitter: a random wait between 0 and the exponential backoff, so throttled clients don't retry in step
+def backoff(attempt, base=0.5, cap=30.0):
+    return random.uniform(0.0, min(cap, base * 2 ** attempt))
+
+
+class HostLimiter:
+    def __init__(self, max_rate=20.0, min_rate=0.5, window=4, max_window=16):
+        self.max_rate = max_rate
+        self.min_rate = min_rate
+        self.max_window = max_window
+        self.bucket = TokenBucket(max_rate)
+        self.window = float(window)
+        self.in_flight = 0
+        self.blocked_until = 0.0
+        self.decreased = 0.0
+        self.condition = threading.Condition()
+        self.requests = 0
+        self.throttled = 0
+        self.retries = 0
+        self.waited = 0.0
+
+    # 0 when the request may go (and is counted as in flight), else the seconds to wait or None to wait
+    # until another request finishes
+    def reserve(self):
+        now = time.monotonic()
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        if self.in_flight >= int(self.window):
+            return None
+        wait = self.bucket.take(now)
+        if wait:
+            return wait
+        self.in_flight += 1
+        self.requests += 1
+        return 0.0
+
+    # budget.limit_wait raises instead of waiting past the deadline of the question
+    def acquire(self, budget=None):
+        start = time.monotonic()
+        with self.condition:
+            wait = self.reserve()
+            while wait != 0.0:
+                self.condition.wait(wait if budget is None else budget.limit_wait(wait))
+                wait = self.reserve()
+            self.waited += time.monotonic() - start
+
+    async def acquire_async(self, budget=None):
+        start = time.monotonic()
+        while True:
+            with self.condition:
+                wait = self.reserve()
+                if wait == 0.0:
+                    self.waited += time.monotonic() - start
+                    return
+            # the event loop can't block on the condition, so a full window is polled
+            wait = wait if wait is not None else 0.01
+            await asyncio.sleep(wait if budget is None else budget.limit_wait(wait))
+
+    # additive increase after an answer, multiplicative decrease after a 429/503,
+    # throttled is None when the request failed without a response
+    def release(self, throttled=None, delay=None):
+        with self.condition:
+            self.in_flight -= 1
+            now = time.monotonic()
+            if throttled:
+                self.throttled += 1
+                if delay is not None:
+                    self.blocked_until = max(self.blocked_until, now + delay)
+                if now - self.decreased >= DECREASE_INTERVAL:
+                    self.decreased = now
+                    self.window = max(1.0, self.window / 2)
+                    self.bucket.rate = max(self.min_rate, self.bucket.rate / 2)
+            elif throttled is False:
+                self.window = min(self.max_window, self.window + 1 / self.window)
+                self.bucket.rate = min(self.max_rate, self.bucket.rate + 1 / self.bucket.rate)
+            self.condition.notify_all()
+
+    def stats(self):
+        with self.condition:
+            return {
+                'requests':  self.requests,
+                'throttled': self.throttled,
+                'retries':   self.retries,
+                'waited':    self.waited,
+                'rate':      self.bucket.rate,
+                'window':    int(self.window),
+            }
+
+
+class RateLimiter:
+    def __init__(self, max_rate=20.0, max_window=16, max_retries=5, base_delay=0.5, max_delay=30.0):
+        self.max_rate = max_rate
+        self.max_window = max_window
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.hosts = {}
+        self.lock = threading.Lock()
+
+    def host(self, url):
+        netloc = urlsplit(url).netloc
+        with self.lock:
+            limiter = self.hosts.get(netloc)
+            if limiter is None:
+                limiter = self.hosts[netloc] = HostLimiter(self.max_rate, max_window=self.max_window)
+            return limiter
+
+    # the wait before the next attempt: the Retry-After of the server, but at least the jittered backoff
+    def delay(self, attempt, delay):
+        return max(delay or 0.0, backoff(attempt, self.base_delay, self.max_delay))
+
+    # the wait before a retry, which is also one more call of the budget
+    @staticmethod
+    def retry(budget, delay):
+        if budget is not None:
+            delay = budget.limit_wait(delay)
+            budget.spend()
+        return delay
+
+    # send() makes the request and returns a requests.Response; a throttled response is retried
+    # max_retries times, after that Throttled is raised
+    def call(self, url, send, budget=None):
+        host = self.host(url)
+        for attempt in range(self.max_retries + 1):
+            host.acquire(budget)
+            try:
+                response = send()
+            except Exception:
+                host.release()
+                raise
+            throttled = response.status_code in THROTTLED
+            delay = retry_after(response.headers.get('Retry-After')) if throttled else None
+            host.release(throttled, delay)
+            if not throttled:
+                return response
+            if attempt == self.max_retries:
+                raise Throttled(url, response.status_code)
+            delay = self.retry(budget, self.delay(attempt, delay))
+            with host.condition:
+                host.retries += 1
+            time.sleep(delay)
+
+    # the same for async_http.py, send() is a coroutine function returning (status, headers, body)
+    async def call_async(self, url, send, budget=None):
+        host = self.host(url)
+        for attempt in range(self.max_retries + 1):
+            await host.acquire_async(budget)
+            try:
+                status, headers, body = await send()
+            except BaseException:
+                host.release()
+                raise
+            throttled = status in THROTTLED
+            delay = retry_after(headers.get('Retry-After')) if throttled else None
+            host.release(throttled, delay)
+            if not throttled:
+                return status, headers, body
+            if attempt == self.max_retries:
+                raise Throttled(url, status)
+            delay = self.retry(budget, self.delay(attempt, delay))
+            with host.condition:
+                host.retries += 1
+            await asyncio.sleep(delay)
+
+    def stats(self):
+        with self.lock:
+            hosts = dict(self.hosts)
+        return {netloc: limiter.stats() for netloc, limiter in hosts.items()}
+
+    def print_stats(self, file):
+        for netloc, stats in self.stats().items():
+            print('Rate limit {}: {requests} requests, {throttled} throttled, {retries} retries, {waited:.1f}s '
+                  'waited, settled at {rate:.1f} requests/s and {window} in flight'.format(netloc, **stats), file=file)
+
+
+_shared = None
+_shared_lock = threading.Lock()
+
+
+def shared_limiter():
+    global _shared
+    with _shared_lock:
+        if _shared is None:
+            _shared = RateLimiter()
+        return _shared
@@ -0,0 +1,224 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# record/replay stand-in for the wikidata search api and the sparql endpoint
+#
+# record: every request made through transport.py (and the asyncio client) is stored in a fixture file
+#   QA_RECORD=fixtures.sqlite python3 system.py < test_questions.txt
+# replay: a local http server answers the same requests from the fixture file
+#   python3 replay.py fixtures.sqlite --port 8765 --latency recorded
+#   QA_REPLAY_URL=http://127.0.0.1:8765 python3 system.py < test_questions.txt
+# while replaying, https://www.wikidata.org/w/api.php is requested as http://127.0.0.1:8765/www.wikidata.org/w/api.php
+# throttling: with --throttle-rate the server allows that many requests per second per host and answers the rest
+# with 429 and a Retry-After header, with --throttle-concurrency more requests in flight per host get a 503
+#   python3 replay.py fixtures.sqlite --latency 0.2 --throttle-rate 5 --throttle-concurrency 3
+
+import argparse
+import json
+import math
+import os
+import sqlite3
+import sys
+import threading
+import time
+import zlib
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlencode, urlsplit
+
+from rate_limit import TokenBucket
+
+RECORD_ENV = 'QA_RECORD'
+REPLAY_ENV = 'QA_REPLAY_URL'
+
+
+# the same request always gets the same key, no matter the order of the parameters
+def request_key(url, params=None):
+    parts = urlsplit(url)
+    pairs = parse_qsl(parts.query, keep_blank_values=True)
+    if params:
+        pairs += list(params.items()) if isinstance(params, dict) else list(params)
+    query = urlencode(sorted((str(key), str(value)) for key, value in pairs))
+    return '{}://{}{}?{}'.format(parts.scheme, parts.netloc, parts.path, query)
+
+
+# https://host/path -> <replay url>/host/path, so one server can stand in for every host
+def replay_url(url):
+    base = os.environ.get(REPLAY_ENV)
+    if not base:
+        return url
+    parts = urlsplit(url)
+    rewritten = '{}/{}{}'.format(base.rstrip('/'), parts.netloc, parts.path)
+    return rewritten + ('?' + parts.query if parts.query else '')
+
+
+class FixtureStore:
+    def __init__(self, path):
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute('CREATE TABLE IF NOT EXISTS fixtures ('
+                        '  key          TEXT PRIMARY KEY,'
+                        '  status       INTEGER NOT NULL,'
+                        '  content_type TEXT    NOT NULL,'
+                        '  body         BLOB    NOT NULL,'
+                        '  elapsed      REAL    NOT NULL)')
+        self.db.commit()
+
+    def __len__(self):
+        with self.lock:
+            return self.db.execute('SELECT COUNT(*) FROM fixtures').fetchone()[0]
+
+    def record(self, url, params, status, content_type, body, elapsed):
+        with self.lock:
+            self.db.execute('INSERT OR REPLACE INTO fixtures VALUES (?, ?, ?, ?, ?)',
+                            (request_key(url, params), status, content_type, zlib.compress(body), elapsed))
+            self.db.commit()
+
+    # (status, content type, body, elapsed) or None if this request was never recorded
+    def lookup(self, url, params=None):
+        with self.lock:
+            row = self.db.execute('SELECT status, content_type, body, elapsed FROM fixtures WHERE key = ?',
+                                  (request_key(url, params),)).fetchone()
+        if row is None:
+            return None
+        status, content_type, body, elapsed = row
+        return status, content_type, zlib.decompress(body), elapsed
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+
+_recorder = None
+_recorder_lock = threading.Lock()
+
+
+# the fixture store to record into, if QA_RECORD is set
+def recorder():
+    global _recorder
+    path = os.environ.get(RECORD_ENV)
+    if not path:
+        return None
+    with _recorder_lock:
+        if _recorder is None:
+            _recorder = FixtureStore(path)
+        return _recorder
+
+
+class ReplayHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        parts = urlsplit(self.path)
+        host, _, path = parts.path.lstrip('/').partition('/')
+        status, delay = self.server.admit(host)
+        if status is not None:
+            self.send_body(status, 'application/json', json.dumps({'error': 'too many requests'}).encode(),
+                           {'Retry-After': str(delay)})
+            return
+        try:
+            self.replay(host, path, parts.query)
+        finally:
+            self.server.done(host)
+
+    def replay(self, host, path, query):
+        fixture = self.server.fixtures.lookup('https://{}/{}?{}'.format(host, path, query))
+        if fixture is None:
+            self.server.misses += 1
+            self.send_body(404, 'application/json', json.dumps({'error': 'no fixture for this request'}).encode())
+            return
+
+        status, content_type, body, elapsed = fixture
+        self.server.hits += 1
+        delay = elapsed if self.server.latency == 'recorded' else float(self.server.latency)
+        if delay > 0:
+            time.sleep(delay)
+        self.send_body(status, content_type, body)
+
+    def send_body(self, status, content_type, body, headers=None):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        if self.server.verbose:
+            super().log_message(*args)
+
+
+class ReplayServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    # latency: 'recorded' to sleep as long as the original request took, or a fixed number of seconds
+    # throttle_rate / throttle_concurrency: simulated limits per host, 0 means no limit
+    def __init__(self, fixtures, address=('127.0.0.1', 8765), latency='0', verbose=False, throttle_rate=0.0,
+                 throttle_concurrency=0):
+        super().__init__(address, ReplayHandler)
+        self.fixtures = fixtures
+        self.latency = latency
+        self.verbose = verbose
+        self.throttle_rate = throttle_rate
+        self.throttle_concurrency = throttle_concurrency
+        self.lock = threading.Lock()
+        self.buckets = {}
+        self.in_flight = {}
+        self.hits = 0
+        self.misses = 0
+        self.throttled = 0
+
+    # (None, None) when the request is served, else the status and Retry-After seconds of the refusal
+    def admit(self, host):
+        with self.lock:
+            if self.throttle_concurrency and self.in_flight.get(host, 0) >= self.throttle_concurrency:
+                self.throttled += 1
+                return 503, 1
+            if self.throttle_rate:
+                bucket = self.buckets.get(host)
+                if bucket is None:
+                    bucket = self.buckets[host] = TokenBucket(self.throttle_rate)
+                wait = bucket.take()
+                if wait:
+                    self.throttled += 1
+                    return 429, math.ceil(wait)
+            self.in_flight[host] = self.in_flight.get(host, 0) + 1
+            return None, None
+
+    def done(self, host):
+        with self.lock:
+            self.in_flight[host] -= 1
+
+    @property
+    def url(self):
+        return 'http://{}:{}'.format(*self.server_address[:2])
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description='Replay recorded wikidata responses from a local http server')
+    arg_parser.add_argument('fixtures', help='fixture file written with QA_RECORD=<file>')
+    arg_parser.add_argument('--host', default='127.0.0.1')
+    arg_parser.add_argument('--port', type=int, default=8765)
+    arg_parser.add_argument('--latency', default='0',
+                            help="'recorded' to replay the original response times, or a fixed delay in seconds")
+    arg_parser.add_argument('--throttle-rate', metavar='N', type=float, default=0.0,
+                            help='answer more than N requests per second per host with 429 (default: no limit)')
+    arg_parser.add_argument('--throttle-concurrency', metavar='N', type=int, default=0,
+                            help='answer more than N requests in flight per host with 503 (default: no limit)')
+    arg_parser.add_argument('--verbose', action='store_true', help='log every request')
+    args = arg_parser.parse_args()
+
+    fixtures = FixtureStore(args.fixtures)
+    server = ReplayServer(fixtures, (args.host, args.port), args.latency, args.verbose, args.throttle_rate,
+                          args.throttle_concurrency)
+    print('Replaying {} fixtures on {} (set {}={})'.format(len(fixtures), server.url, REPLAY_ENV, server.url))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print('{} hits, {} misses, {} throttled'.format(server.hits, server.misses, server.throttled), file=sys.stderr)
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
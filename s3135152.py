@@ -1,8 +1,9 @@
 #!/usr/bin/env python3
 
-import spacy
 import sys
-import requests
+import transport
+
+from models import get_model
 
 
 def questionmaker(possible_properties, possible_entities, parse):
@@ -60,12 +61,12 @@ def create_and_fire_query(property_list, entity_list):
     property_list.sort(key=len, reverse=True)
     for prop in property_list:
         prop_params['search'] = prop
-        json = requests.get(url, prop_params).json()
+        json = transport.get(url, prop_params).json()
         for result in json['search']:
             properties.append(result['id'])
     for entity in entity_list:
         params['search'] = entity
-        json = requests.get(url, params).json()
+        json = transport.get(url, params).json()
         for result in json['search']:
             entities.append(result['id'])
     if len(entities) > 0 and len(properties) > 0:
@@ -78,8 +79,8 @@ def create_and_fire_query(property_list, entity_list):
                     'FILTER(LANG(?valLabel) = "en")'
                     '}}}}'.format(entities[i], properties[p])
                 )
-                data = requests.get('https://query.wikidata.org/sparql',
-                                    params={'query': select_query, 'format': 'json'}).json()
+                data = transport.get('https://query.wikidata.org/sparql',
+                                     params={'query': select_query, 'format': 'json'}).json()
                 if (len(data['results']['bindings'])) > 0:
                     for item in data['results']['bindings']:
                         for var in item:
@@ -100,7 +101,7 @@ def create_and_fire_query(property_list, entity_list):
 
 def main():
     print("Loading spacy model..")
-    nlp = spacy.load('en_core_web_sm')
+    nlp = get_model('en_core_web_sm')
     example_questions = [
         "Who is the CEO of Sony Music?", "Who are the members of the Beatles?",
         "Who was the composer of the moonlight sonata?", "What are Queen its genres?",
@@ -123,4 +124,4 @@ def main():
 
 
 if __name__ == '__main__':
-    main(sys.argv)
+    main()
@@ -1,11 +1,12 @@
 #!/user/bin/python3
 
 import sys
-import requests
+import transport
 import re
-import spacy
 from spacy.matcher import Matcher
 
+from models import get_matcher, get_model
+
 
 def do_query(ent, atr):
     url = 'https://query.wikidata.org/sparql'
@@ -19,7 +20,7 @@ def do_query(ent, atr):
 }}"""
 
     query = query.format(ent, atr, atr)
-    res = requests.get(url, params={'query': query, 'format': 'json'}).json()
+    res = transport.get(url, params={'query': query, 'format': 'json'}).json()
     answers = []
     for result in res['results']['bindings']:
         for var in result:
@@ -55,7 +56,8 @@ def print_example_queries():
     print("\nPlease ask a question like the example questions shown above.\n")
 
 
-def get_entities(doc, url):
+# the named entities in the question, without a possessive 's
+def entity_names(doc):
     entities = [e.text for e in doc.ents]
     betterEnts = []
     # for token in doc:
@@ -64,18 +66,23 @@ def get_entities(doc, url):
         if ent[-2:] == "'s":
             ent = ent[:-2]
         betterEnts.append(ent)
+    return betterEnts
+
+
+def get_entities(doc, url):
     try:
-        entity = betterEnts[0]
+        entity = entity_names(doc)[0]
     except IndexError:
         return None
     eParams = {'search': entity, 'action': 'wbsearchentities', 'language': 'en', 'format': 'json'}
-    entities = requests.get(url, eParams).json()
+    entities = transport.get(url, eParams).json()
     entityList = [result['id'] for result in entities['search']]
 
     return entityList
 
 
-def get_attributes(doc, matcher, url):
+# the lemmas of the matched attribute phrases
+def attribute_names(doc, matcher):
     matches = matcher(doc)
     atts = []
     for match_id, start, end in matches:
@@ -95,14 +102,17 @@ def get_attributes(doc, matcher, url):
             matched_span = doc[start:end]
 
         atts.append(matched_span.lemma_)
+    return atts
 
+
+def get_attributes(doc, matcher, url):
     try:
-        attribute = atts[0]
+        attribute = attribute_names(doc, matcher)[0]
     except IndexError:
         return None
     aParams = {'search': attribute, 'action': 'wbsearchentities', 'language': 'en', 'format': 'json',
                'type': 'property'}
-    attributes = requests.get(url, aParams).json()
+    attributes = transport.get(url, aParams).json()
     attributeList = [result['id'] for result in attributes['search']]
 
     return attributeList
@@ -180,8 +190,8 @@ def make_matcher(nlp):
 
 def main():
     print_example_queries()
-    nlp = spacy.load('en')
-    matcher = make_matcher(nlp)
+    nlp = get_model('en')
+    matcher = get_matcher('en', 's3225143', make_matcher)
     for line in sys.stdin:
         line = line.rstrip()
         answer = create_and_fire_query(line, nlp, matcher)
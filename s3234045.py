@@ -1,17 +1,16 @@
 #! /usr/bin/env python3
 # -*- coding: utf-8 -*-
 
-import spacy
 from spacy.matcher import Matcher
 
-from datetime import datetime
-from requests import get
-from SPARQLWrapper import SPARQLWrapper, JSON
-
 # handle input
 from sys import stdin
 from unidecode import unidecode
 
+from answers import from_binding
+from models import get_matcher, get_model
+from transport import get, sparql
+
 
 class NoAnswerError(Exception):
     def __init__(self, *args, **kwargs):
@@ -21,24 +20,26 @@ class NoAnswerError(Exception):
 
 
 class QuestionSolver:
+    stop_words = {'a', 'by', 'of', 'the', '\'s', '"'}
+    # simple translation dictionary to convert some phrasings into query keywords
+    trans_dict = {
+        'direct': 'director',
+        'write': 'author',
+        'compose': 'composer',
+        'invent': 'inventor',
+        'bear': 'birth',
+        'die': 'death',
+    }
+
     def __init__(self):
-        self.sparql = SPARQLWrapper('https://query.wikidata.org/sparql')
+        self.sparql_url = 'https://query.wikidata.org/sparql'
         self.wiki_api_url = 'https://www.wikidata.org/w/api.php'
-        self.nlp = spacy.load('en_core_web_md')
-        self.matcher = self.init_matcher()
-        self.stop_words = {'a', 'by', 'of', 'the', '\'s', '"'}
-        # simple translation dictionary to convert some phrasings into query keywords
-        self.trans_dict = {
-            'direct': 'director',
-            'write': 'author',
-            'compose': 'composer',
-            'invent': 'inventor',
-            'bear': 'birth',
-            'die': 'death',
-        }
+        self.nlp = get_model('en_core_web_md')
+        self.matcher = get_matcher('en_core_web_md', 's3234045', self.init_matcher)
 
-    def init_matcher(self):
-        matcher = Matcher(self.nlp.vocab)
+    @staticmethod
+    def init_matcher(nlp):
+        matcher = Matcher(nlp.vocab)
         matcher.add('WHEN_WHERE', None, [{'LOWER': {'IN': ['when', 'where']}},
                                          {'DEP': {'IN': ['ROOT', 'aux', 'auxpass']}}])
         matcher.add('X_OF_Y', None, [{'DEP': 'attr', 'LOWER': {'IN': ['who', 'what']}},
@@ -50,19 +51,18 @@ class QuestionSolver:
         try:
             parsed_question = self.parse_question(question.strip().strip(' ?'))
             for answer in self.query_answer(parsed_question[0], parsed_question[1]):
-                answer = answer['answerLabel']['value']
-                try:
-                    date = datetime.strptime(answer, '%Y-%m-%dT%H:%M:%SZ')
-                    print(date.strftime('%m/%d/%Y'))
-                except ValueError:
-                    print(answer)
+                print(from_binding(answer['answerLabel']).format('%m/%d/%Y'))
 
         except NoAnswerError as err:
             print(err)
 
     def parse_question(self, question):
-        result = self.nlp(question)
-        results = self.matcher(result)
+        return self.parse_doc(self.nlp(question), self.matcher)
+
+    # (property, entity) from an already parsed question, also used by ensemble.py
+    @classmethod
+    def parse_doc(cls, result, matcher):
+        results = matcher(result)
 
         try:
             match_id, start, end = results[0]
@@ -84,14 +84,15 @@ class QuestionSolver:
             prop = ['who', next(w for w in result if w.dep_ == 'ROOT').lemma_]
             entity = [w.text for w in result[end:]]
 
-        prop = self.translate_query(prop)
+        prop = cls.translate_query(prop)
 
-        entity = ' '.join(w for w in entity if w not in self.stop_words)
+        entity = ' '.join(w for w in entity if w not in cls.stop_words)
 
         return prop, entity
 
-    def translate_query(self, query):
-        query = [w for w in query if w not in self.stop_words]
+    @classmethod
+    def translate_query(cls, query):
+        query = [w for w in query if w not in cls.stop_words]
         new_query = ' '.join(query)  # default is to simply join the words
 
         # in some cases, the words in questions must be "translated"
@@ -103,15 +104,15 @@ class QuestionSolver:
 
         if query[1] in ['direct', 'write', 'compose', 'invent']:
             if query[0] == 'who':
-                new_query = self.trans_dict[query[1]]
+                new_query = cls.trans_dict[query[1]]
             if query[0] == 'when':
                 new_query = 'inception'
 
         elif query[1] in ['bear', 'die']:
             if query[0] == 'when':
-                new_query = 'date of ' + self.trans_dict[query[1]]
+                new_query = 'date of ' + cls.trans_dict[query[1]]
             elif query[0] == 'where':
-                new_query = 'place of ' + self.trans_dict[query[1]]
+                new_query = 'place of ' + cls.trans_dict[query[1]]
 
         elif query[1] == ['publish', 'release']:
             if query[0] == 'who':
@@ -157,9 +158,7 @@ class QuestionSolver:
                     '}}'.format(wikidata_entity, wikidata_prop)
                 )
 
-                self.sparql.setQuery(query_string)
-                self.sparql.setReturnFormat(JSON)
-                results = self.sparql.query().convert()['results']['bindings']
+                results = sparql(query_string, self.sparql_url)['results']['bindings']
 
                 if not results:
                     continue
@@ -1,11 +1,12 @@
 #!/usr/bin/python3
 import sys
 import re
-import requests
+import transport
 
-import spacy
 from spacy.matcher import Matcher
 
+from models import get_matcher, get_model
+
 def print_example_queries():
     print('Example questions: \n')
     queries = ['What is the birthplace of Elvis?',"Who is Taylor Swift's mother?",'When was John Lennon born?','Who are the children of Michael Jackson?','What genre is Metallica?','What are the recording studios of the Script?','Where is the burial place of Kurt Cobain?','What are the awards of The Beatles?','When was Katy Perry born?','When did Elvis die?']
@@ -13,17 +14,8 @@ def print_example_queries():
         print(line)    
     print('\nPlease ask a question like the example questions.')
     
-def create_and_fire_query(line):
-    entity = []
-    nlp = spacy.load('en')
+def make_matcher(nlp):
     matcher = Matcher(nlp.vocab)
-    result=nlp(line)
-    for w in result:
-        ent = w.ent_iob_
-        if ent == 'B' or ent == 'I':
-            entity.append(w.text)
-    entityname = ' '.join(entity)
-
     pattern1 = [{'LOWER': 'the', 'OP': '?'},
           {'POS': 'NOUN'},
           {'POS': 'NOUN', 'OP' : '?'}]
@@ -42,15 +34,39 @@ def create_and_fire_query(line):
     matcher.add('TEST2', None, pattern3)
     matcher.add('WHO', None, pattern1)
     matcher.add('HOW', None, pattern2)
+    return matcher
+
+
+# de naam van de entity en de gematchte stukken van de vraag, zonder netwerk (ook gebruikt door ensemble.py)
+def extract(result, matcher):
+    entity = []
+    for w in result:
+        ent = w.ent_iob_
+        if ent == 'B' or ent == 'I':
+            entity.append(w.text)
+    entityname = ' '.join(entity)
+
     matches = matcher(result)
     a = [result[start:end].text for match_id, start, end in matches]
 
+    properties = []
     for e in a:
         if(entityname in e):
             e = e.replace(entityname,'')
         e=e.replace("How","")
         e=e.replace("Was","")
-        if(a != 'How'):
+        properties.append(e)
+    return entityname, properties
+
+
+def create_and_fire_query(line):
+    # model en matcher worden maar een keer per proces geladen, niet meer voor elke vraag
+    nlp = get_model('en')
+    matcher = get_matcher('en', 's3254259', make_matcher)
+    entityname, properties = extract(nlp(line), matcher)
+
+    for e in properties:
+        if(properties != 'How'):
             try:
                 prop = findproperties(e)
                 ent = findentities(entityname)
@@ -67,7 +83,7 @@ def findproperties(line):
               'format':'json',
               'type':'property'}
     params['search'] = line.rstrip()
-    json = requests.get(url,params).json()
+    json = transport.get(url,params).json()
     return(json['search'][0]['id'])
 
         
@@ -77,7 +93,7 @@ def findentities(line):
               'language':'en',
               'format':'json',}
     params['search'] = line.rstrip()
-    json = requests.get(url,params).json()
+    json = transport.get(url,params).json()
     return(json['search'][0]['id'])
 
         
@@ -89,7 +105,7 @@ def answer(prop, ent):
     query = query.replace("(","{")
     query = query.replace(")","}")
     url = 'https://query.wikidata.org/sparql'
-    data = requests.get(url,params={'query': query, 'format': 'json'}).json()
+    data = transport.get(url,params={'query': query, 'format': 'json'}).json()
     for item in data['results']['bindings']:
         for var in item :
             answers.append('{}'.format(item[var]['value']))
@@ -97,21 +113,19 @@ def answer(prop, ent):
 
 def main(argv):
     print_example_queries()
-#Dit staat buiten de main omdat in de fucntie de example vragen niet werden getoond.    
-main(sys.argv)
-for line in sys.stdin:
-    line = line.replace(" ?","")
-    line = line.replace("?","")
-    line = line.replace(" the ", " ")
-    line = line.replace("'s","")
-    line = line.rstrip()
-
-    answerstring = create_and_fire_query(line)
-    try:
-        for a in answerstring:
-            print(a)
-    except:
-        print("No answer was found, please try again")
-        
+    for line in sys.stdin:
+        line = line.replace(" ?","")
+        line = line.replace("?","")
+        line = line.replace(" the ", " ")
+        line = line.replace("'s","")
+        line = line.rstrip()
+
+        answerstring = create_and_fire_query(line)
+        try:
+            for a in answerstring:
+                print(a)
+        except:
+            print("No answer was found, please try again")
+
 if __name__ == "__main__":
     main(sys.argv)
\ No newline at end of file
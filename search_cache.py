@@ -0,0 +1,147 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# persistent cache for the results of the wikidata search api (list=search)
+# entries are keyed by the normalized search string and the namespace that was searched
+
+import json
+import sqlite3
+import threading
+import time
+
+from unidecode import unidecode
+
+# sentinel value, None is a valid cached result (the api found nothing)
+MISS = object()
+
+# a hit only updates the access time in memory; the access times are written together once there are this many,
+# after this many seconds, or with the next insert (so eviction sees them), keeping cache hits free of writes
+TOUCH_BATCH = 256
+TOUCH_INTERVAL = 30.0
+
+
+def normalize(string):
+    # the same search with other casing, whitespace or accents gives the same results
+    return ' '.join(unidecode(string).lower().split())
+
+
+class SearchCache:
+    def __init__(self, path='search_cache.sqlite', ttl=7 * 24 * 3600, max_entries=100000):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # (query, namespace) -> access time that is not written yet
+        self.touched = {}
+        self.flushed = time.time()
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute('CREATE TABLE IF NOT EXISTS search ('
+                        '  query     TEXT    NOT NULL,'
+                        '  namespace INTEGER NOT NULL,'
+                        '  results   TEXT    NOT NULL,'
+                        '  created   REAL    NOT NULL,'
+                        '  accessed  REAL    NOT NULL,'
+                        '  PRIMARY KEY (query, namespace))')
+        self.db.execute('CREATE INDEX IF NOT EXISTS search_accessed ON search (accessed)')
+        self.db.commit()
+        # running row count, so an insert doesn't need a COUNT(*) (other processes can add rows too, so it is
+        # counted again before evicting)
+        self.size = self.count()
+
+    def count(self):
+        return self.db.execute('SELECT COUNT(*) FROM search').fetchone()[0]
+
+    def __len__(self):
+        with self.lock:
+            return self.count()
+
+    def get(self, string, namespace):
+        key = normalize(string)
+        now = time.time()
+        with self.lock:
+            row = self.db.execute('SELECT results, created FROM search WHERE query = ? AND namespace = ?',
+                                  (key, namespace)).fetchone()
+            if row is None or now - row[1] > self.ttl:
+                if row is not None:
+                    # expired entry, throw it away right away
+                    self.size -= self.db.execute('DELETE FROM search WHERE query = ? AND namespace = ?',
+                                                 (key, namespace)).rowcount
+                    self.db.commit()
+                self.misses += 1
+                return MISS
+            self.touch(key, namespace, now)
+            self.hits += 1
+            return json.loads(row[0])
+
+    def touch(self, key, namespace, now):
+        self.touched[key, namespace] = now
+        if len(self.touched) >= TOUCH_BATCH or now - self.flushed >= TOUCH_INTERVAL:
+            self.flush()
+            self.db.commit()
+
+    # write the pending access times, the caller commits
+    def flush(self):
+        if self.touched:
+            self.db.executemany('UPDATE search SET accessed = ? WHERE query = ? AND namespace = ?',
+                                [(accessed, key, namespace) for (key, namespace), accessed in self.touched.items()])
+            self.touched = {}
+        self.flushed = time.time()
+
+    def put(self, string, namespace, results):
+        now = time.time()
+        row = (json.dumps(results), now, now, normalize(string), namespace)
+        with self.lock:
+            if self.db.execute('UPDATE search SET results = ?, created = ?, accessed = ? '
+                               'WHERE query = ? AND namespace = ?', row).rowcount == 0:
+                self.db.execute('INSERT OR REPLACE INTO search (results, created, accessed, query, namespace) '
+                                'VALUES (?, ?, ?, ?, ?)', row)
+                self.size += 1
+            self.flush()
+            self.evict()
+            self.db.commit()
+
+    # drop the least recently used entries until we are back under max_entries
+    def evict(self):
+        if self.size <= self.max_entries:
+            return
+        self.size = self.count()
+        if self.size <= self.max_entries:
+            return
+        self.db.execute('DELETE FROM search WHERE rowid IN '
+                        '(SELECT rowid FROM search ORDER BY accessed LIMIT ?)', (self.size - self.max_entries,))
+        self.evictions += self.size - self.max_entries
+        self.size = self.max_entries
+
+    def purge_expired(self):
+        with self.lock:
+            removed = self.db.execute('DELETE FROM search WHERE created < ?', (time.time() - self.ttl,)).rowcount
+            self.size -= removed
+            self.db.commit()
+        return removed
+
+    def hit_ratio(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def stats(self):
+        return {
+            'entries':   len(self),
+            'hits':      self.hits,
+            'misses':    self.misses,
+            'evictions': self.evictions,
+            'hit_ratio': self.hit_ratio(),
+        }
+
+    # write the access times that are still pending
+    def save(self):
+        with self.lock:
+            self.flush()
+            self.db.commit()
+
+    def close(self):
+        self.save()
+        with self.lock:
+            self.db.close()
@@ -0,0 +1,231 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# local replacement for the wikidata search api (list=search) used by QuestionSolver.query_wikidata_api
+# an inverted index over the english labels, aliases and descriptions of items (namespace 0) and
+# properties (namespace 120), ranked with BM25 and matching on unidecode-normalized tokens, with prefix
+# and fuzzy (one edit) matching for tokens that are not in the index
+#
+# build an index from a wikidata entity JSON dump subset with: python3 search_index.py music.json music.index
+# the index file is memory-mapped at startup, nothing is rebuilt
+
+import json
+import math
+import mmap
+import re
+import struct
+import sys
+
+from array import array
+
+from unidecode import unidecode
+
+from triplestore import padded, string_table
+
+MAGIC = b'QAS1'
+HEADER = struct.Struct('<4sIIIIIf')
+
+# field weights: a word in the label counts more than a word in an alias or the description
+LABEL_WEIGHT = 3.0
+ALIAS_WEIGHT = 2.0
+DESCRIPTION_WEIGHT = 1.0
+
+PREFIX_WEIGHT = 0.5
+FUZZY_WEIGHT = 0.3
+MAX_EXPANSIONS = 50
+
+K1 = 1.2
+B = 0.75
+
+
+def tokenize(text):
+    return re.findall(r'\w+', unidecode(text).lower())
+
+
+def read_entity_json(lines, language='en'):
+    # yields (id, namespace, [(text, weight), ...], sitelinks) per entity
+    for line in lines:
+        line = line.strip().rstrip(',')
+        if not line or line in ('[', ']'):
+            continue
+        entity = json.loads(line)
+        fields = []
+        if language in entity.get('labels', {}):
+            fields.append((entity['labels'][language]['value'], LABEL_WEIGHT))
+        for alias in entity.get('aliases', {}).get(language, []):
+            fields.append((alias['value'], ALIAS_WEIGHT))
+        if language in entity.get('descriptions', {}):
+            fields.append((entity['descriptions'][language]['value'], DESCRIPTION_WEIGHT))
+        namespace = 120 if entity.get('type') == 'property' or entity['id'].startswith('P') else 0
+        yield entity['id'], namespace, fields, len(entity.get('sitelinks', {}))
+
+
+def build(documents, path):
+    titles = []
+    namespaces = array('I')
+    lengths = array('f')
+    priors = array('f')
+    postings = {}
+    for doc_id, (title, namespace, fields, sitelinks) in enumerate(documents):
+        titles.append(title)
+        namespaces.append(namespace)
+        # popular entities (many sitelinks) win ties, like they do in the wikidata search
+        priors.append(math.log1p(sitelinks))
+        frequencies = {}
+        for text, weight in fields:
+            for token in tokenize(text):
+                frequencies[token] = frequencies.get(token, 0.0) + weight
+        lengths.append(sum(frequencies.values()))
+        for token, frequency in frequencies.items():
+            postings.setdefault(token, []).append((doc_id, frequency))
+
+    vocabulary = sorted(postings)
+    posting_offsets = array('I', [0])
+    posting_docs = array('I')
+    posting_tf = array('f')
+    for token in vocabulary:
+        for doc_id, frequency in postings[token]:
+            posting_docs.append(doc_id)
+            posting_tf.append(frequency)
+        posting_offsets.append(len(posting_docs))
+
+    vocab_offsets, vocab_blob = string_table(vocabulary)
+    title_offsets, title_blob = string_table(titles)
+    average_length = sum(lengths) / len(lengths) if lengths else 0.0
+    with open(path, 'wb') as index_file:
+        index_file.write(HEADER.pack(MAGIC, len(vocabulary), len(padded(vocab_blob)), len(posting_docs),
+                                     len(titles), len(padded(title_blob)), average_length))
+        index_file.write(b'\0' * (-HEADER.size % 4))
+        for section in (vocab_offsets, padded(vocab_blob), posting_offsets, posting_docs, posting_tf,
+                        namespaces, lengths, priors, title_offsets, padded(title_blob)):
+            index_file.write(section if isinstance(section, bytes) else section.tobytes())
+    return len(titles), len(vocabulary)
+
+
+def within_one_edit(a, b):
+    if abs(len(a) - len(b)) > 1:
+        return False
+    if len(a) > len(b):
+        a, b = b, a
+    i = 0
+    while i < len(a) and a[i] == b[i]:
+        i += 1
+    if len(a) == len(b):
+        return a[i + 1:] == b[i + 1:]
+    return a[i:] == b[i + 1:]
+
+
+class SearchIndex:
+    def __init__(self, path):
+        with open(path, 'rb') as index_file:
+            self.mmap = mmap.mmap(index_file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, n_terms, vocab_len, n_postings, n_docs, title_len, self.average_length = \
+            HEADER.unpack_from(self.mmap)
+        if magic != MAGIC:
+            raise ValueError('{} is not a search index file'.format(path))
+
+        view = memoryview(self.mmap)
+        position = HEADER.size + (-HEADER.size % 4)
+
+        def section(length, cast='I'):
+            nonlocal position
+            part = view[position:position + length]
+            position += length
+            return part.cast(cast) if cast else part
+
+        self.n_terms = n_terms
+        self.n_docs = n_docs
+        self.vocab_offsets = section((n_terms + 1) * 4)
+        self.vocab_blob = section(vocab_len, cast=None)
+        self.posting_offsets = section((n_terms + 1) * 4)
+        self.posting_docs = section(n_postings * 4)
+        self.posting_tf = section(n_postings * 4, cast='f')
+        self.namespaces = section(n_docs * 4)
+        self.lengths = section(n_docs * 4, cast='f')
+        self.priors = section(n_docs * 4, cast='f')
+        self.title_offsets = section((n_docs + 1) * 4)
+        self.title_blob = section(title_len, cast=None)
+
+    def term(self, term_id):
+        return bytes(self.vocab_blob[self.vocab_offsets[term_id]:self.vocab_offsets[term_id + 1]]).decode('utf-8')
+
+    def title(self, doc_id):
+        return bytes(self.title_blob[self.title_offsets[doc_id]:self.title_offsets[doc_id + 1]]).decode('utf-8')
+
+    def lower_bound(self, token):
+        low, high = 0, self.n_terms
+        while low < high:
+            middle = (low + high) // 2
+            if self.term(middle) < token:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    # the index terms that a query token matches, with the weight of the match
+    def expand(self, token):
+        start = self.lower_bound(token)
+        if start < self.n_terms and self.term(start) == token:
+            matches = [(start, 1.0)]
+        else:
+            matches = []
+        if len(token) >= 3:
+            term_id = start + len(matches)
+            while term_id < self.n_terms and len(matches) < MAX_EXPANSIONS and self.term(term_id).startswith(token):
+                matches.append((term_id, PREFIX_WEIGHT))
+                term_id += 1
+        if not matches and len(token) >= 4:
+            # fuzzy: terms within one edit that start with the same letter
+            term_id = self.lower_bound(token[0])
+            while term_id < self.n_terms and len(matches) < MAX_EXPANSIONS:
+                term = self.term(term_id)
+                if not term.startswith(token[0]):
+                    break
+                if within_one_edit(token, term):
+                    matches.append((term_id, FUZZY_WEIGHT))
+                term_id += 1
+        return matches
+
+    def score(self, tokens, namespace):
+        scores = {}
+        for token in tokens:
+            token_scores = {}
+            for term_id, weight in self.expand(token):
+                start, end = self.posting_offsets[term_id], self.posting_offsets[term_id + 1]
+                idf = math.log(1 + (self.n_docs - (end - start) + 0.5) / (end - start + 0.5))
+                for i in range(start, end):
+                    doc_id = self.posting_docs[i]
+                    if self.namespaces[doc_id] != namespace:
+                        continue
+                    tf = self.posting_tf[i]
+                    norm = K1 * (1 - B + B * self.lengths[doc_id] / self.average_length)
+                    bm25 = weight * idf * tf * (K1 + 1) / (tf + norm)
+                    # a query token counts once per document, with its best matching term
+                    if bm25 > token_scores.get(doc_id, 0.0):
+                        token_scores[doc_id] = bm25
+            for doc_id, bm25 in token_scores.items():
+                scores[doc_id] = scores.get(doc_id, 0.0) + bm25
+        return scores
+
+    # same shape as QuestionSolver.query_wikidata_api: at most five ids, or None if nothing matched
+    def search(self, string, namespace=0, limit=5):
+        tokens = tokenize(string)
+        if not tokens or not self.n_docs:
+            return None
+        scores = self.score(tokens, namespace)
+        ranked = sorted(scores, key=lambda doc_id: (-scores[doc_id] - 0.1 * self.priors[doc_id], doc_id))
+        return [self.title(doc_id) for doc_id in ranked[:limit]] or None
+
+
+def main():
+    if len(sys.argv) != 3:
+        print('Usage: python3 search_index.py <entities.json> <output.index>', file=sys.stderr)
+        sys.exit(1)
+    source, path = sys.argv[1:]
+    with open(source, encoding='utf-8') as source_file:
+        n_docs, n_terms = build(read_entity_json(source_file), path)
+    print('Indexed {} entities and properties ({} terms) into {}'.format(n_docs, n_terms, path))
+
+
+if __name__ == '__main__':
+    main()
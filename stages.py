@@ -0,0 +1,60 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# stage timing hooks for QuestionParser and QuestionSolver
+# the parser and solver wrap each stage in timer.stage(name), call timer.remote_call(kind) for every
+# request that goes over the network and timer.annotate(...) to describe the current stage (used by tracing.py).
+# by default they use NULL_TIMER, which does nothing.
+
+import contextlib
+import threading
+import time
+
+STAGES = ['parse', 'match', 'extract', 'translate', 'search', 'sparql', 'format']
+
+
+class NullTimer:
+    _null = contextlib.nullcontext()
+
+    def stage(self, name, **info):
+        return self._null
+
+    def annotate(self, **info):
+        pass
+
+    def remote_call(self, kind):
+        pass
+
+
+NULL_TIMER = NullTimer()
+
+
+class StageTimer:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.durations = {}
+        self.remote_calls = {}
+
+    @contextlib.contextmanager
+    def stage(self, name, **info):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            with self.lock:
+                self.durations[name] = self.durations.get(name, 0.0) + elapsed
+
+    def annotate(self, **info):
+        pass
+
+    def remote_call(self, kind):
+        with self.lock:
+            self.remote_calls[kind] = self.remote_calls.get(kind, 0) + 1
+
+    # the timings since the last reset, used to measure one question at a time
+    def reset(self):
+        with self.lock:
+            durations, remote_calls = self.durations, self.remote_calls
+            self.durations, self.remote_calls = {}, {}
+        return durations, remote_calls
@@ -1,18 +1,37 @@
 #! /usr/bin/env python3
 # -*- coding: utf-8 -*-
 
-import spacy
+import argparse
+import asyncio
+import contextvars
 import sys
 
 from spacy.matcher import Matcher
 
-from datetime import datetime
-from requests import get
-from SPARQLWrapper import SPARQLWrapper, JSON
+from concurrent.futures import ThreadPoolExecutor
 
 # handle input
 from unidecode import unidecode
 
+from answer_cache import AnswerCache
+from answers import NUMBER, Answer, boolean, from_bindings
+from async_http import AsyncClient
+from budget import DEADLINE, NO_BUDGET, THROTTLED, Budget, BudgetStats, DeadlineExceeded
+from candidate_order import CandidateOrder
+from models import get_matcher, get_model, print_memory
+from negative_cache import NegativeCache
+from parse_cache import ParseCache
+from pipeline import BatchEngine
+from prefilter import REJECT, Prefilter
+from property_index import PropertyIndex
+from rate_limit import Throttled
+from search_cache import MISS, SearchCache
+from search_index import SearchIndex
+from stages import NULL_TIMER
+from tracing import Tracer
+from transport import get, shared_transport, sparql
+from triplestore import TripleStore
+
 
 class NoAnswerError(Exception):
     def __init__(self, *args, **kwargs):
@@ -21,6 +40,10 @@ class NoAnswerError(Exception):
         super().__init__(*args)
 
 
+# de vraag voldoet niet aan een van onze patterns
+ILL_FORMED = 'Question is ill-formed, cannot answer this question'
+
+
 class QuestionParser:
     stop_words = {'a', 'by', 'of', 'the', '\'s', '"', '\''}
     trans_dict = {
@@ -33,33 +56,138 @@ class QuestionParser:
         'born':    'birth',
     }
 
-    def __init__(self):
-        self.nlp = spacy.load('en')
-        self.matcher = self.init_matcher()
+    def __init__(self, cache_size=1024, cache_path=None):
+        # het model en de matcher worden gedeeld met de rest van het proces, zie models.py
+        self.nlp = get_model('en')
+        self.matcher = get_matcher('en', 'system.QuestionParser', self.init_matcher)
+        # herkent een deel van de vraagtypes al aan de eerste woorden, zie prefilter.py
+        self.prefilter = Prefilter()
+        # timing van de stappen, zie stages.py
+        self.timer = NULL_TIMER
+        # LRU cache van geparsede vragen, met een cache_path ook bewaard als DocBin (zie parse_cache.py)
+        self.cache = ParseCache(self.nlp.vocab, cache_size, cache_path) if cache_size else None
 
     # parse een vraag met de juiste parser functie en translate de entity/property
     def __call__(self, question):
+        question = self.prepare(question)
+        result = self.cached(question)
+        if result is MISS:
+            q_type, needs_parser = self.prefilter(question)
+            if q_type is REJECT:
+                result = NoAnswerError(ILL_FORMED)
+            else:
+                result = self.parse_result(question, self.parse(question, needs_parser), q_type)
+        if isinstance(result, NoAnswerError):
+            raise NoAnswerError(*result.args)
+        return result
+
+    # zoals __call__ voor een hele batch (al voorbereide) vragen met nlp.pipe,
+    # geeft per vraag het resultaat of de NoAnswerError terug
+    # met contexts (een contextvars.Context per vraag, zie pipeline.py) loopt alles behalve nlp.pipe zelf
+    # in de context van de vraag, zodat de tracing bij de juiste vraag komt
+    def parse_many(self, questions, batch_size=32, contexts=None):
+        def run(i, func, *args):
+            return contexts[i].run(func, *args) if contexts is not None else func(*args)
+
+        results = [run(i, self.cached, question) for i, question in enumerate(questions)]
+        routes = {i: run(i, self.prefilter, questions[i]) for i, result in enumerate(results) if result is MISS}
+        docs = {}
+        for i, (q_type, needs_parser) in routes.items():
+            if q_type is REJECT:
+                results[i] = NoAnswerError(ILL_FORMED)
+            elif self.cache is not None:
+                docs[i] = run(i, self.cache.get_doc, questions[i], needs_parser)
+            else:
+                docs[i] = None
+        # dezelfde vraag maar een keer parsen, ook binnen een batch
+        for needs_parser in (True, False):
+            unparsed = list(dict.fromkeys(questions[i] for i, doc in docs.items()
+                                          if doc is None and routes[i][1] == needs_parser))
+            if not unparsed:
+                continue
+            # een batch hoort niet bij een enkele vraag, dus deze stage loopt in de context van de aanroeper
+            with self.timer.stage('parse', questions=len(unparsed)):
+                parsed = dict(zip(unparsed, self.nlp.pipe(unparsed, batch_size=batch_size,
+                                                          disable=self.disabled_pipes(needs_parser))))
+            for i, doc in docs.items():
+                if doc is None and routes[i][1] == needs_parser:
+                    docs[i] = parsed[questions[i]]
+                    if self.cache is not None:
+                        self.cache.put_doc(questions[i], docs[i], needs_parser)
+        for i, doc in docs.items():
+            results[i] = run(i, self.parse_result, questions[i], doc, routes[i][0])
+        return results
+
+    # de geparsede Doc van een vraag, uit de cache als we de vraag al eens gezien hebben
+    # (een Doc zonder dependency parser alleen als die ook niet nodig is)
+    def parse(self, question, needs_parser=True):
+        doc = self.cache.get_doc(question, needs_parser) if self.cache is not None else None
+        if doc is None:
+            with self.timer.stage('parse'):
+                doc = self.nlp(question, disable=self.disabled_pipes(needs_parser))
+            if self.cache is not None:
+                self.cache.put_doc(question, doc, needs_parser)
+        return doc
+
+    # de parser functies van de snelle vraagtypes zonder dependencies kunnen zonder de dependency parser
+    @staticmethod
+    def disabled_pipes(needs_parser):
+        return [] if needs_parser else ['parser']
+
+    def cached(self, question):
+        if self.cache is None:
+            return MISS
+        result = self.cache.get_result(question)
+        self.timer.annotate(parse_cache='miss' if result is MISS else 'hit')
+        return result
+
+    def parse_result(self, question, doc, q_type=None):
+        try:
+            result = self.parse_doc(doc, q_type)
+        except NoAnswerError as err:
+            result = err
+        if self.cache is not None:
+            self.cache.put_result(question, result)
+        return result
+
+    @staticmethod
+    def prepare(question):
         question = question.strip()
-        if question[-1] != "?":
+        if not question or question[-1] != "?":
             question += "?"
-        result = self.nlp(question)
-        try:
-            match_id, start, end = self.matcher(result)[0]
-        except IndexError:
-            # question voldoet niet aan een van onze patterns, error dus
-            raise NoAnswerError('Question is ill-formed, cannot answer this question')
+        return question
+
+    # de matcher en parser functies op een al geparsede vraag (zoals uit nlp.pipe),
+    # de matcher is niet nodig als de prefilter het vraagtype al weet
+    def parse_doc(self, result, q_type=None):
+        if q_type is None:
+            with self.timer.stage('match'):
+                matches = self.matcher(result)
+                try:
+                    match_id, start, end = matches[0]
+                except IndexError:
+                    # question voldoet niet aan een van onze patterns, error dus
+                    raise NoAnswerError(ILL_FORMED)
+                q_type = result.vocab.strings[match_id]
+                self.timer.annotate(pattern=q_type)
+        else:
+            self.timer.annotate(pattern=q_type, fast_path=True)
 
         # wel een match gevonden, run de juiste parser functie
-        ent, prop, extra = getattr(self, result.vocab.strings[match_id].lower())(result)
+        with self.timer.stage('extract'):
+            ent, prop, extra = getattr(self, q_type.lower())(result)
         # translate de property en verwijder stopwords uit de entity
-        prop = self.translate_query(prop) if prop is not None else None
-        ent = ' '.join(w for w in ent if w not in self.stop_words) if ent is not None else None
-        extra = ' '.join(extra) if extra is not None else None
-        return result.vocab.strings[match_id], ent, prop, extra
+        with self.timer.stage('translate'):
+            prop = self.translate_query(prop) if prop is not None else None
+            ent = ' '.join(w for w in ent if w not in self.stop_words) if ent is not None else None
+            extra = ' '.join(extra) if extra is not None else None
+            self.timer.annotate(entity=ent, property=prop, extra=extra)
+        return q_type, ent, prop, extra
 
-    def init_matcher(self):
+    @staticmethod
+    def init_matcher(nlp):
         # hier komen de patterns voor het identificeren van vraagtypes
-        matcher = Matcher(self.nlp.vocab)
+        matcher = Matcher(nlp.vocab)
         matcher.add('X_OF_Y', None,
                     [
                         {'DEP': {'IN': ['attr', 'advmod', 'nsubj']}, 'LOWER': {'IN': ['who', 'what', 'when']}},
@@ -425,10 +553,38 @@ class QuestionParser:
 
 
 class QuestionSolver:
-    def __init__(self):
-        self.sparql = SPARQLWrapper('https://query.wikidata.org/sparql')
+    def __init__(self, search_cache=None, workers=1, batch_queries=False, async_limit=10, store=None,
+                 search_index=None, parse_cache_size=1024, parse_cache_path=None, property_index=None,
+                 answer_cache=None, negative_cache=None, candidate_order=None, deadline=None, max_calls=None):
+        self.sparql_url = 'https://query.wikidata.org/sparql'
         self.wiki_api_url = 'https://www.wikidata.org/w/api.php'
-        self.parser = QuestionParser()
+        self.parser = QuestionParser(parse_cache_size, parse_cache_path)
+        # optionele SearchCache, zodat dezelfde zoektermen niet steeds opnieuw naar de api gaan
+        self.search_cache = search_cache
+        # met meer dan een worker worden de entity/property combinaties tegelijk gequeried
+        self.pool = ThreadPoolExecutor(max_workers=workers) if workers > 1 else None
+        # een enkele SPARQL query per vraag in plaats van een per entity/property combinatie
+        self.batch_queries = batch_queries
+        # maximaal aantal gelijktijdige http requests in de asyncio api (answer / answer_many)
+        self.async_limit = async_limit
+        self.parse_executor = None
+        # optionele lokale TripleStore, dan gaan de SPARQL queries niet meer over het netwerk
+        self.store = store
+        # optionele lokale SearchIndex in plaats van de wikidata search api
+        self.search_index = search_index
+        # optionele PropertyIndex, dan worden de meeste properties zonder search api gevonden
+        self.property_index = property_index
+        # optionele AnswerCache met de antwoorden per entity/property combinatie, zie answer_cache.py
+        self.answer_cache = answer_cache
+        # optionele NegativeCache met de entity/property combinaties die niks opleverden
+        self.negative_cache = negative_cache
+        # optionele CandidateOrder: probeer de combinaties die vaker een antwoord gaven eerst
+        self.candidate_order = candidate_order
+        # maximale tijd (seconden) en aantal search/SPARQL requests per vraag, None is onbeperkt (zie budget.py)
+        self.deadline = deadline
+        self.max_calls = max_calls
+        self.budget_stats = BudgetStats()
+        self.timer = NULL_TIMER
 
         self.query_dict = {
 
@@ -512,33 +668,33 @@ class QuestionSolver:
                              '}}',
             'DID_X':         'ASK {{ wd:{} wdt:{} wd:{} . }}',
         }
+        # de vraagtypes waarvan een leeg resultaat betekent dat de entity deze property niet heeft
+        self.negative_types = {q_type for q_type, query_string in self.query_dict.items()
+                               if 'wd:{} wdt:{} ?answer' in query_string and 'count(' not in query_string}
 
     def __call__(self, question):
-        try:
-            # parse de vraag die gesteld werd, maar haal eerst het vraagteken en evt. witruimte weg
-            q_type, ent, prop, extra = self.parser(question)
-            if ent is None and prop is None:
-                raise NoAnswerError
-            else:
-                return self.query_answer(q_type, ent, prop, extra)
+        with self.timer.stage('question', question=question):
+            try:
+                # parse de vraag die gesteld werd, maar haal eerst het vraagteken en evt. witruimte weg
+                budget = self.new_budget()
+                q_type, ent, prop, extra = self.parser(question)
+                if ent is None and prop is None:
+                    raise NoAnswerError
+                else:
+                    return self.query_answer(q_type, ent, prop, extra, budget)
 
-        # geen antwoord gevonden
-        except NoAnswerError:
-            raise
+            # geen antwoord gevonden
+            except NoAnswerError:
+                raise
 
     def print_question(self, question):
-        for token in self.parser.nlp(question.strip()):
+        for token in self.parser.parse(self.parser.prepare(question)):
             print('\t'.join((token.text, token.lemma_, token.pos_, token.tag_, token.dep_, token.head.lemma_)))
 
     @staticmethod
     def print_answers(answers):
-        for i in range(len(answers)):
-            try:
-                date = datetime.strptime(answers[i], '%Y-%m-%dT%H:%M:%SZ')
-                answers[i] = date.strftime('%m/%d/%Y')
-            except ValueError:
-                pass
-            print(answers[i])
+        for answer in answers:
+            print(answer.format('%m/%d/%Y'))
         return answers
 
     # deze functie kan entities makkelijk vinden, moet nog worden getest ivm hoofdlettergevoeligheid
@@ -546,31 +702,73 @@ class QuestionSolver:
     def get_entities(question):
         return [w for w in question if w.ent_iob_ in ['B', 'I']]
 
+    def use_timer(self, timer):
+        self.timer = self.parser.timer = timer
+
+    # de deadline en het aantal requests voor een nieuwe vraag, de tijd loopt vanaf nu
+    # ook zonder limieten, want een vraag die door wikidata afgeremd wordt telt ook mee (zie budget.py)
+    def new_budget(self):
+        return Budget(self.deadline, self.max_calls, self.budget_stats)
+
     # zoeken op wikidata naar entities/properties
-    def query_wikidata_api(self, string, prop_search=False):
-        params = {
+    def query_wikidata_api(self, string, prop_search=False, budget=NO_BUDGET):
+        with self.timer.stage('search', string=string, namespace=120 if prop_search else 0):
+            return self.search_wikidata(string, prop_search, budget)
+
+    def search_wikidata(self, string, prop_search, budget=NO_BUDGET):
+        namespace = 120 if prop_search else 0
+        if prop_search and self.property_index is not None:
+            pids = self.property_index.lookup(string)
+            if pids is not None:
+                self.timer.annotate(source='property_index')
+                return pids
+        if self.search_index is not None:
+            self.timer.annotate(source='index')
+            return self.search_index.search(string, namespace)
+        if self.search_cache is not None:
+            cached = self.search_cache.get(string, namespace)
+            self.timer.annotate(cache='miss' if cached is MISS else 'hit')
+            if cached is not MISS:
+                return cached
+
+        self.timer.remote_call('search')
+        response = budget.call(get, self.wiki_api_url, self.search_params(string, namespace))
+        results = self.search_titles(response.json(), prop_search)
+        if self.search_cache is not None:
+            self.search_cache.put(string, namespace, results)
+        return results
+
+    @staticmethod
+    def search_params(string, namespace):
+        return {
             'action':      'query',
             'format':      'json',
             'list':        'search',
             'srsearch':    unidecode(string),
-            'srnamespace': 120 if prop_search else 0,
+            'srnamespace': namespace,
             'srlimit':     5,  # maximaal vijf entities per query
             'srprop':      '',
         }
+
+    @staticmethod
+    def search_titles(response, prop_search):
         try:
-            results = get(self.wiki_api_url, params).json()['query']['search']
+            results = response['query']['search']
         except KeyError:
             raise NoAnswerError
         # als we naar properties zoeken moet het eerste deel "Property:" van de titel eraf gehaald worden
         # de wikidata link heeft namelijk de volgende opbouw: https://www.wikidata.org/wiki/Property:P576
         return [res['title'][9:] if prop_search else res['title'] for res in results] if results else None
 
-    def query_answer(self, question_type, ent, prop, extra):
+    def query_answer(self, question_type, ent, prop, extra, budget=NO_BUDGET):
+        return self.execute(question_type, *self.resolve(ent, prop, extra, budget), budget)
+
+    def resolve(self, ent, prop, extra, budget=NO_BUDGET):
         # query de wikidata api om wikidata entities te vinden voor property en entity
         # dirty hack om een element in de lijst te hebben als de property unset is (zoals bij "What is X?" vragen)
-        wikidata_props = self.query_wikidata_api(prop, True) if prop is not None else ['']
-        wikidata_entities = self.query_wikidata_api(ent) if ent is not None else ['']
-        extra = self.query_wikidata_api(extra)[0] if extra is not None else ''
+        wikidata_props = self.query_wikidata_api(prop, True, budget) if prop is not None else ['']
+        wikidata_entities = self.query_wikidata_api(ent, False, budget) if ent is not None else ['']
+        extra = self.query_wikidata_api(extra, False, budget)[0] if extra is not None else ''
         # niks gevonden voor de entity of de property
         if wikidata_props is None:
             raise NoAnswerError('Could not find the property you asked for')
@@ -579,62 +777,536 @@ class QuestionSolver:
             raise NoAnswerError('Could not find the entity you asked about')
 
         # we vinden meerdere entities en properties: probeer per entity de gevonden properties
-        for wikidata_entity in wikidata_entities:
-            for wikidata_prop in wikidata_props:
-                # de juiste query moet nog gekozen worden op basis van question type
-                query_string = self.query_dict[question_type]
-                # vul de query string met de gevonden entity/property/extra in de vraag
-                query_string = query_string.format(wikidata_entity, wikidata_prop, extra)
-                self.sparql.setQuery(query_string)
-                self.sparql.setReturnFormat(JSON)
-
-                if question_type == 'DID_X':
-                    result = self.sparql.query().convert()['boolean']
-                    return ['Yes'] if result else ['No']
-
-                results = self.sparql.query().convert()['results']['bindings']
-
-                # geen resultaten voor deze combinatie, probeer de volgende
-                if not results:
-                    continue
-
-                # resultaat / resultaten gevonden, return de resultaten
-                answers = []
-                for result in results:
-                    for var in result:
-                        answer = result[var]['value']
-                        try:
-                            # convert resultaat naar een datum als het nodig is
-                            date = datetime.strptime(answer, '%Y-%m-%dT%H:%M:%SZ')
-                            answer = date.strftime('%Y-%m-%d')
-                        except ValueError:
-                            pass
-                        answers.append(answer)
+        return [(e, p) for e in wikidata_entities for p in wikidata_props], extra
+
+    def execute(self, question_type, candidates, extra, budget=NO_BUDGET):
+        # een ASK query heeft altijd een antwoord, dus alleen de eerste combinatie wordt gevraagd, ook met batch_queries
+        if question_type == 'DID_X':
+            return self.query_candidate(question_type, *candidates[0], extra, budget)
+
+        ordered = self.order_candidates(question_type, candidates)
+        if self.batch_queries:
+            return self.query_batched(question_type, ordered, extra, budget)
+
+        # het aantal SPARQL requests dat echt verstuurd werd, en een voor een ook per combinatie
+        calls, costs = budget.calls, None
+        if self.pool is not None:
+            answers, winner = self.query_concurrent(question_type, ordered, extra, budget)
+        else:
+            costs = {}
+            answers, winner = self.query_sequential(question_type, ordered, extra, budget, costs)
+        self.record_winner(question_type, candidates, ordered, winner, budget.calls - calls, costs)
+        if answers is None:
+            raise NoAnswerError
+        return answers
+
+    # de antwoorden van de eerste combinatie met resultaten, en de positie van die combinatie
+    # als de deadline of het aantal requests op is stopt de loop met een DeadlineExceeded
+    # costs krijgt het aantal requests van elke geprobeerde combinatie
+    def query_sequential(self, question_type, candidates, extra, budget=NO_BUDGET, costs=None):
+        for i, (wikidata_entity, wikidata_prop) in enumerate(candidates):
+            calls = budget.calls
+            answers = self.query_candidate(question_type, wikidata_entity, wikidata_prop, extra, budget)
+            if costs is not None:
+                costs[wikidata_entity, wikidata_prop] = budget.calls - calls
+            # geen resultaten voor deze combinatie, probeer de volgende
+            if answers is not None:
+                return answers, i
+        return None, None
+
+    # stuur alle combinaties tegelijk naar de pool, maar kijk de resultaten in de originele volgorde na:
+    # de hoogst gerankte combinatie met resultaten wint, de rest wordt geannuleerd of genegeerd
+    # met een maximum aantal requests gaan alleen zoveel combinaties tegelijk als er requests over zijn,
+    # anders kunnen lager gerankte combinaties ze opmaken; de rest volgt daarna een voor een
+    def query_concurrent(self, question_type, candidates, extra, budget=NO_BUDGET):
+        left = budget.calls_left()
+        head = candidates if left is None else candidates[:max(1, left)]
+        # elke combinatie draait in een kopie van de context van de vraag, zodat de tracing klopt (zie tracing.py)
+        futures = [self.pool.submit(contextvars.copy_context().run, self.query_candidate, question_type,
+                                    wikidata_entity, wikidata_prop, extra, budget)
+                   for wikidata_entity, wikidata_prop in head]
+        try:
+            for i, future in enumerate(futures):
+                answers = future.result()
+                if answers is not None:
+                    return answers, i
+        finally:
+            for future in futures:
+                future.cancel()
+        answers, winner = self.query_sequential(question_type, candidates[len(head):], extra, budget)
+        return answers, winner + len(head) if winner is not None else None
+
+    # de volgorde waarin de combinaties geprobeerd worden, zonder CandidateOrder de volgorde van de search api
+    def order_candidates(self, question_type, candidates):
+        if self.candidate_order is None:
+            return candidates
+        return self.candidate_order.order(question_type, candidates)
+
+    def record_winner(self, question_type, candidates, ordered, winner, calls, costs=None):
+        if self.candidate_order is not None:
+            self.candidate_order.record(question_type, candidates, ordered, winner, calls, costs)
+
+    # een enkele query voor alle combinaties: VALUES bindt alle kandidaten aan ?entity en ?prop,
+    # en elke rij vertelt welke combinatie het antwoord opleverde
+    def query_batched(self, question_type, candidates, extra, budget=NO_BUDGET):
+        candidates, cached = self.batch_candidates(question_type, candidates, extra)
+        result = None
+        if candidates:
+            result = self.run_query(self.batch_query_string(question_type, candidates, extra), budget,
+                                    candidates=len(candidates))
+        return self.batched_answers(question_type, candidates, extra, result, cached)
+
+    # de combinaties die nog gevraagd moeten worden, zonder de combinaties die al eens niks opleverden
+    def batch_candidates(self, question_type, candidates, extra):
+        candidates, cached = self.cached_prefix(question_type, candidates, extra)
+        candidates = [(wikidata_entity, wikidata_prop) for wikidata_entity, wikidata_prop in candidates
+                      if not self.known_empty(question_type, wikidata_entity, wikidata_prop)]
+        return candidates, cached
+
+    # alleen de kandidaten voor de eerste combinatie met een bekend antwoord hoeven nog gevraagd te worden
+    def cached_prefix(self, question_type, candidates, extra):
+        if self.answer_cache is not None:
+            for i, (wikidata_entity, wikidata_prop) in enumerate(candidates):
+                cached = self.cached_answers(question_type, wikidata_entity, wikidata_prop, extra)
+                if cached is not MISS:
+                    return candidates[:i], cached
+        return candidates, MISS
+
+    def batched_answers(self, question_type, candidates, extra, result, cached=MISS):
+        rows = {}
+        if result is not None:
+            for binding in result['results']['bindings']:
+                key = (binding.pop('entity')['value'].rsplit('/', 1)[-1],
+                       binding.pop('prop')['value'].rsplit('/', 1)[-1] if 'prop' in binding else '')
+                rows.setdefault(key, []).append(binding)
+
+        with self.timer.stage('format'):
+            answers = {key: self.convert_bindings(bindings) for key, bindings in rows.items()}
+        # COUNT met GROUP BY geeft geen rij voor een combinatie zonder matches, een losse query geeft dan 0
+        if 'count(' in self.query_dict[question_type]:
+            for wikidata_entity, wikidata_prop in candidates:
+                key = (wikidata_entity, wikidata_prop if self.batch_uses_prop(question_type) else '')
+                answers.setdefault(key, [Answer('0', NUMBER)])
+        for (wikidata_entity, wikidata_prop), pair_answers in answers.items():
+            self.store_answers(question_type, wikidata_entity, wikidata_prop, extra, pair_answers)
+        for wikidata_entity, wikidata_prop in candidates:
+            if (wikidata_entity, wikidata_prop) not in answers:
+                self.store_answers(question_type, wikidata_entity, wikidata_prop, extra, None)
+
+        # kies de hoogst gerankte combinatie die iets opleverde
+        for wikidata_entity, wikidata_prop in candidates:
+            key = (wikidata_entity, wikidata_prop if self.batch_uses_prop(question_type) else '')
+            if key in answers:
+                return answers[key]
+
+        # anders de eerste combinatie met een antwoord uit de cache
+        if cached is not MISS:
+            return cached
+
+        raise NoAnswerError
+
+    def batch_uses_prop(self, question_type):
+        return '$prop' in self.query_dict[question_type].format('$entity', '$prop', '')
+
+    def batch_query_string(self, question_type, candidates, extra):
+        # vul de template met variabelen in plaats van een vaste entity/property
+        query_string = self.query_dict[question_type].format('$entity', '$prop', extra)
+        query_string = query_string.replace('BIND(wd:$entity as ?entity) .', '')
+        query_string = query_string.replace('wd:$entity', '?entity').replace('wdt:$prop', '?prop')
+
+        if self.batch_uses_prop(question_type):
+            pairs = dict.fromkeys(candidates)
+            values = 'VALUES (?entity ?prop) {{ {} }} '.format(
+                ' '.join('(wd:{} wdt:{})'.format(e, p) for e, p in pairs))
+            variables = '?entity ?prop'
+        else:
+            entities = dict.fromkeys(e for e, _ in candidates)
+            values = 'VALUES ?entity {{ {} }} '.format(' '.join('wd:{}'.format(e) for e in entities))
+            variables = '?entity'
 
+        query_string = query_string.replace('SELECT ', 'SELECT {} '.format(variables), 1)
+        query_string = query_string.replace('WHERE { ', 'WHERE {{ {}'.format(values), 1)
+        if 'count(' in query_string:
+            query_string += ' GROUP BY {}'.format(variables)
+        return query_string
+
+    def query_candidate(self, question_type, wikidata_entity, wikidata_prop, extra, budget=NO_BUDGET):
+        cached = self.cached_answers(question_type, wikidata_entity, wikidata_prop, extra)
+        if cached is not MISS:
+            return cached
+        if self.known_empty(question_type, wikidata_entity, wikidata_prop):
+            return None
+        result = self.run_query(self.candidate_query(question_type, wikidata_entity, wikidata_prop, extra), budget,
+                                entity=wikidata_entity, property=wikidata_prop)
+        answers = self.candidate_answers(question_type, result)
+        self.store_answers(question_type, wikidata_entity, wikidata_prop, extra, answers)
+        return answers
+
+    # antwoorden uit de AnswerCache, MISS als de combinatie nog niet (of niet meer) bekend is
+    def cached_answers(self, question_type, wikidata_entity, wikidata_prop, extra):
+        if self.answer_cache is None:
+            return MISS
+        cached = self.answer_cache.get(*self.answer_key(question_type, wikidata_entity, wikidata_prop, extra))
+        self.timer.annotate(answer_cache='miss' if cached is MISS else 'hit')
+        return cached
+
+    def store_answers(self, question_type, wikidata_entity, wikidata_prop, extra, answers):
+        if answers is None:
+            if self.negative_cache is not None and question_type in self.negative_types:
+                self.negative_cache.add(wikidata_entity, wikidata_prop)
+        elif self.answer_cache is not None:
+            self.answer_cache.put(*self.answer_key(question_type, wikidata_entity, wikidata_prop, extra), answers)
+
+    # deze combinatie leverde eerder al niks op
+    def known_empty(self, question_type, wikidata_entity, wikidata_prop):
+        if self.negative_cache is None or question_type not in self.negative_types:
+            return False
+        empty = self.negative_cache.known_empty(wikidata_entity, wikidata_prop)
+        self.timer.annotate(negative_cache='hit' if empty else 'miss')
+        return empty
+
+    # templates zonder property (WHO_IS, WHAT_IS, ...) geven voor elke property hetzelfde antwoord
+    def answer_key(self, question_type, wikidata_entity, wikidata_prop, extra):
+        if not self.batch_uses_prop(question_type):
+            wikidata_prop = ''
+        return self.query_dict[question_type], wikidata_entity, wikidata_prop, extra
+
+    def candidate_query(self, question_type, wikidata_entity, wikidata_prop, extra):
+        # de juiste query moet nog gekozen worden op basis van question type
+        query_string = self.query_dict[question_type]
+        # vul de query string met de gevonden entity/property/extra in de vraag
+        return query_string.format(wikidata_entity, wikidata_prop, extra)
+
+    def candidate_answers(self, question_type, result):
+        if question_type == 'DID_X':
+            return [boolean(result['boolean'])]
+
+        with self.timer.stage('format'):
+            return self.convert_bindings(result['results']['bindings'])
+
+    def run_query(self, query_string, budget=NO_BUDGET, **info):
+        with self.timer.stage('sparql', **info):
+            if self.store is not None:
+                result = self.store.query(query_string)
+            else:
+                self.timer.remote_call('sparql')
+                # via de gedeelde transport, zodat de verbinding met het endpoint hergebruikt wordt
+                result = budget.call(sparql, query_string, self.sparql_url)
+            self.timer.annotate(rows=len(result['results']['bindings']) if 'results' in result else None)
+            return result
+
+    @staticmethod
+    def convert_bindings(results):
+        # geen resultaten voor deze combinatie
+        if not results:
+            return None
+
+        # resultaat / resultaten gevonden, een Answer per waarde met het type uit de binding (zie answers.py)
+        return from_bindings(results)
+
+    # asyncio versie van __call__: zoeken en SPARQL gaan via een niet-blokkerende http client,
+    # spaCy parst in een eigen thread buiten de event loop
+    async def answer(self, question, client=None):
+        if client is None:
+            async with AsyncClient(self.async_limit) as client:
+                return await self.answer(question, client)
+
+        # de deadline geldt voor de hele vraag, ook voor de requests die nog onderweg zijn
+        budget = self.new_budget()
+        with self.timer.stage('question', question=question):
+            try:
+                return await asyncio.wait_for(self.answer_within(question, client, budget), budget.remaining())
+            except asyncio.TimeoutError:
+                if budget.remaining() == 0.0:
+                    raise budget.exceeded(DEADLINE)
+                raise
+            except Throttled as err:
+                raise budget.exceeded(THROTTLED) from err
+
+    async def answer_within(self, question, client, budget):
+        loop = asyncio.get_running_loop()
+        if self.parse_executor is None:
+            self.parse_executor = ThreadPoolExecutor(max_workers=1)
+        q_type, ent, prop, extra = await loop.run_in_executor(self.parse_executor, contextvars.copy_context().run,
+                                                              self.parser, question)
+        if ent is None and prop is None:
+            raise NoAnswerError
+
+        candidates, extra = await self.resolve_async(client, ent, prop, extra, budget)
+        return await self.execute_async(client, q_type, candidates, extra, budget)
+
+    # beantwoord meerdere vragen tegelijk; de antwoorden (of de NoAnswerError) staan in dezelfde volgorde
+    async def answer_many(self, questions):
+        async with AsyncClient(self.async_limit) as client:
+            return await asyncio.gather(*(self.answer(q, client) for q in questions), return_exceptions=True)
+
+    async def query_wikidata_api_async(self, client, string, prop_search=False, budget=NO_BUDGET):
+        namespace = 120 if prop_search else 0
+        if prop_search and self.property_index is not None:
+            pids = self.property_index.lookup(string)
+            if pids is not None:
+                return pids
+        if self.search_index is not None:
+            return self.search_index.search(string, namespace)
+        if self.search_cache is not None:
+            cached = self.search_cache.get(string, namespace)
+            if cached is not MISS:
+                return cached
+
+        budget.spend()
+        results = self.search_titles(await client.get_json(self.wiki_api_url, self.search_params(string, namespace),
+                                                           budget), prop_search)
+        if self.search_cache is not None:
+            self.search_cache.put(string, namespace, results)
+        return results
+
+    async def resolve_async(self, client, ent, prop, extra, budget=NO_BUDGET):
+        async def search(string, prop_search=False):
+            return await self.query_wikidata_api_async(client, string, prop_search, budget)
+
+        async def constant(value):
+            return value
+
+        wikidata_props, wikidata_entities, extra = await asyncio.gather(
+            search(prop, True) if prop is not None else constant(['']),
+            search(ent) if ent is not None else constant(['']),
+            search(extra) if extra is not None else constant(None),
+        )
+        extra = extra[0] if extra is not None else ''
+        if wikidata_props is None:
+            raise NoAnswerError('Could not find the property you asked for')
+
+        if wikidata_entities is None:
+            raise NoAnswerError('Could not find the entity you asked about')
+
+        return [(e, p) for e in wikidata_entities for p in wikidata_props], extra
+
+    async def execute_async(self, client, question_type, candidates, extra, budget=NO_BUDGET):
+        async def query(query_string):
+            if self.store is not None:
+                return self.store.query(query_string)
+            budget.spend()
+            return await client.get_json(self.sparql_url, {'query': query_string, 'format': 'json'}, budget)
+
+        async def query_candidate(wikidata_entity, wikidata_prop):
+            cached = self.cached_answers(question_type, wikidata_entity, wikidata_prop, extra)
+            if cached is not MISS:
+                return cached
+            if self.known_empty(question_type, wikidata_entity, wikidata_prop):
+                return None
+            result = await query(self.candidate_query(question_type, wikidata_entity, wikidata_prop, extra))
+            answers = self.candidate_answers(question_type, result)
+            self.store_answers(question_type, wikidata_entity, wikidata_prop, extra, answers)
+            return answers
+
+        if question_type == 'DID_X':
+            return await query_candidate(*candidates[0])
+
+        ordered = self.order_candidates(question_type, candidates)
+        if self.batch_queries:
+            ordered, cached = self.batch_candidates(question_type, ordered, extra)
+            result = await query(self.batch_query_string(question_type, ordered, extra)) if ordered else None
+            return self.batched_answers(question_type, ordered, extra, result, cached)
+
+        # alle combinaties tegelijk, maar de volgorde van de kandidaten bepaalt nog steeds het antwoord
+        # (met een maximum aantal requests net als query_concurrent alleen zoveel als er requests over zijn)
+        calls = budget.calls
+        left = budget.calls_left()
+        head = ordered if left is None else ordered[:max(1, left)]
+        tasks = [asyncio.ensure_future(query_candidate(e, p)) for e, p in head]
+        try:
+            for i, task in enumerate(tasks):
+                answers = await task
+                if answers is not None:
+                    self.record_winner(question_type, candidates, ordered, i, budget.calls - calls)
+                    return answers
+        finally:
+            for task in tasks:
+                task.cancel()
+        for i, (wikidata_entity, wikidata_prop) in enumerate(ordered[len(head):], len(head)):
+            answers = await query_candidate(wikidata_entity, wikidata_prop)
+            if answers is not None:
+                self.record_winner(question_type, candidates, ordered, i, budget.calls - calls)
                 return answers
 
+        self.record_winner(question_type, candidates, ordered, None, budget.calls - calls)
         raise NoAnswerError
 
 
+def write_answers(answer_file, q_id, answers):
+    answer_file.write(q_id)
+    # een afgebroken vraag is iets anders dan een vraag zonder antwoord
+    if isinstance(answers, DeadlineExceeded):
+        answer_file.write("\t" + str(answers))
+    elif answers is not None:
+        for answer in answers:
+            answer_file.write("\t" + str(answer))
+    else:
+        answer_file.write("\tAnswer not found")
+    answer_file.write("\n")
+
+
+# de opties voor de QuestionSolver, ook gebruikt door de andere scripts die een QuestionSolver opzetten
+def add_solver_arguments(arg_parser):
+    arg_parser.add_argument('--search-cache', metavar='PATH',
+                            help='sqlite file used to cache wikidata search results between runs')
+    arg_parser.add_argument('--search-cache-ttl', metavar='SECONDS', type=float, default=7 * 24 * 3600,
+                            help='how long a cached search result stays valid')
+    arg_parser.add_argument('--search-cache-size', metavar='N', type=int, default=100000,
+                            help='maximum number of cached search results')
+    arg_parser.add_argument('--workers', metavar='N', type=int, default=1,
+                            help='number of entity/property combinations to query concurrently')
+    arg_parser.add_argument('--batch-queries', action='store_true',
+                            help='send one SPARQL query per question that covers all entity/property combinations')
+    arg_parser.add_argument('--local-store', metavar='PATH',
+                            help='answer the SPARQL queries from a local triple store built with triplestore.py')
+    arg_parser.add_argument('--search-index', metavar='PATH',
+                            help='find entities and properties in a local index built with search_index.py')
+    arg_parser.add_argument('--property-index', metavar='PATH',
+                            help='look up property phrases in a local index built with property_index.py first')
+    arg_parser.add_argument('--answer-cache', metavar='PATH',
+                            help='json file used to keep the answers per entity/property combination between runs')
+    arg_parser.add_argument('--answer-cache-ttl', metavar='SECONDS', type=float, default=24 * 3600,
+                            help='how long a cached answer stays valid')
+    arg_parser.add_argument('--answer-cache-bytes', metavar='N', type=int, default=16 * 1024 * 1024,
+                            help='memory budget of the answer cache, 0 disables the answer cache')
+    arg_parser.add_argument('--negative-cache-ttl', metavar='SECONDS', type=float, default=6 * 3600,
+                            help='how long an entity/property combination without answers is skipped, 0 disables')
+    arg_parser.add_argument('--candidate-stats', metavar='PATH',
+                            help='json file with the learned hit rates used to order the entity/property candidates')
+    arg_parser.add_argument('--max-rate', metavar='N', type=float, default=20.0,
+                            help='maximum number of requests per second per wikidata host (default %(default)s), '
+                                 'lowered automatically when the endpoint throttles')
+    arg_parser.add_argument('--deadline', metavar='SECONDS', type=float,
+                            help='give up on a question after this many seconds (default: no deadline)')
+    arg_parser.add_argument('--max-remote-calls', metavar='N', type=int,
+                            help='maximum number of search api and SPARQL requests per question (default: no limit)')
+    arg_parser.add_argument('--parse-cache', metavar='PATH',
+                            help='spaCy DocBin file with the parsed questions, reused between runs')
+    arg_parser.add_argument('--parse-cache-size', metavar='N', type=int, default=1024,
+                            help='maximum number of parsed questions kept in memory, 0 disables the parse cache')
+    arg_parser.add_argument('--trace', metavar='PATH',
+                            help='write a json line per stage of every question (spans) to this file')
+
+
+def build_solver(args):
+    # geldt voor de hosts waar nog geen request naartoe ging, dus voor alles als dit voor de eerste vraag gebeurt
+    shared_transport().limiter.max_rate = args.max_rate
+    search_cache = None
+    if args.search_cache:
+        search_cache = SearchCache(args.search_cache, args.search_cache_ttl, args.search_cache_size)
+    store = TripleStore(args.local_store) if args.local_store else None
+    search_index = SearchIndex(args.search_index) if args.search_index else None
+    property_index = PropertyIndex(args.property_index) if args.property_index else None
+    negative_cache = NegativeCache(args.negative_cache_ttl) if args.negative_cache_ttl else None
+    candidate_order = CandidateOrder(args.candidate_stats) if args.candidate_stats else None
+    answer_cache = None
+    if args.answer_cache_bytes:
+        answer_cache = AnswerCache(args.answer_cache, args.answer_cache_ttl, args.answer_cache_bytes)
+    qa_system = QuestionSolver(search_cache, args.workers, args.batch_queries, store=store, search_index=search_index,
+                               parse_cache_size=args.parse_cache_size, parse_cache_path=args.parse_cache,
+                               property_index=property_index, answer_cache=answer_cache,
+                               negative_cache=negative_cache, candidate_order=candidate_order,
+                               deadline=args.deadline, max_calls=args.max_remote_calls)
+    if args.trace:
+        qa_system.use_timer(Tracer(args.trace))
+    return qa_system
+
+
+# schrijf de caches die tussen runs bewaard worden weg
+def save_solver_state(qa_system):
+    if qa_system.search_cache is not None:
+        qa_system.search_cache.save()
+    if qa_system.parser.cache is not None:
+        qa_system.parser.cache.save()
+    if qa_system.answer_cache is not None:
+        qa_system.answer_cache.save()
+    if qa_system.candidate_order is not None:
+        qa_system.candidate_order.save()
+
+
+def print_solver_stats(qa_system, file):
+    search_cache = qa_system.search_cache
+    if search_cache is not None:
+        print('Search cache hit ratio: {:.2%} ({hits} hits, {misses} misses, {evictions} evictions)'.format(
+            search_cache.hit_ratio(), **search_cache.stats()), file=file)
+    print_memory(file)
+    print('Parser paths: {fast} fast, {full} full, {rejected} rejected'.format(
+        **qa_system.parser.prefilter.stats()), file=file)
+    answer_cache = qa_system.answer_cache
+    if answer_cache is not None:
+        print('Answer cache hit ratio: {:.2%} ({hits} hits, {misses} misses, {evictions} evictions, '
+              '{bytes} bytes)'.format(answer_cache.hit_ratio(), **answer_cache.stats()), file=file)
+    candidate_order = qa_system.candidate_order
+    if candidate_order is not None and candidate_order.questions:
+        stats = candidate_order.stats()
+        print('SPARQL calls per question: {calls:.2f} ({questions} questions)'.format(**stats), file=file)
+        if stats['compared']:
+            print('  where the search api order was observed: {compared_calls:.2f} in learned order, '
+                  '{search_order_calls:.2f} in search api order ({compared} questions)'.format(**stats), file=file)
+    negative_cache = qa_system.negative_cache
+    if negative_cache is not None:
+        print('Negative cache: {pairs} empty pairs, {hits} queries skipped'.format(**negative_cache.stats()), file=file)
+    property_index = qa_system.property_index
+    if property_index is not None:
+        print('Property index: {hits} phrases found, {misses} sent to the search api'.format(
+            **property_index.stats()), file=file)
+    budget_stats = qa_system.budget_stats.stats()
+    if qa_system.deadline is not None or qa_system.max_calls is not None:
+        print('Deadline exceeded: {deadline} of {questions} questions ran out of time, {calls} ran out of remote '
+              'calls'.format(**budget_stats), file=file)
+    if budget_stats['throttled']:
+        print('Throttled: {throttled} of {questions} questions were still throttled by wikidata after all '
+              'retries'.format(**budget_stats), file=file)
+    parse_cache = qa_system.parser.cache
+    if parse_cache is not None:
+        print('Parse cache hit ratio: {:.2%} ({hits} hits, {misses} misses, {evictions} evictions)'.format(
+            parse_cache.hit_ratio(), **parse_cache.stats()), file=file)
+
+
+def parse_args():
+    arg_parser = argparse.ArgumentParser(description='Answer questions from standard input into answer_file.txt')
+    add_solver_arguments(arg_parser)
+    arg_parser.add_argument('--pipeline', action='store_true',
+                            help='answer the input with the pipelined batch engine (parse, resolve, SPARQL, write)')
+    arg_parser.add_argument('--batch-size', metavar='N', type=int, default=32,
+                            help='number of questions per nlp.pipe batch in --pipeline mode')
+    arg_parser.add_argument('--stage-workers', metavar='N', type=int, default=1,
+                            help='threads for the resolve and SPARQL stages in --pipeline mode')
+    arg_parser.add_argument('--http-stats', action='store_true',
+                            help='print the number of http connections opened/reused and bytes transferred')
+    return arg_parser.parse_args()
+
+
 def main():
+    args = parse_args()
     print('Loading up QA System...')
-    qa_system = QuestionSolver()
+    qa_system = build_solver(args)
     print('Ready to go!\n')
     # beantwoord vragen vanuit standard input met answer_file.txt als output
     with open('answer_file.txt', 'w') as answer_file:
-        for question in sys.stdin:
-            q_id, q = question.strip().split('\t')
-            answer_file.write(q_id)
-            try:
-                answers_current = qa_system(q)
-                if answers_current is not None:
-                    for answer in answers_current:
-                        answer_file.write("\t" + answer)
-                else:
-                    answer_file.write("\tAnswer not found")
-            except NoAnswerError:
-                answer_file.write("\tAnswer not found")
-            answer_file.write("\n")
+        if args.pipeline:
+            engine = BatchEngine(qa_system, NoAnswerError, args.batch_size, workers=args.stage_workers,
+                                 deadline_error=DeadlineExceeded)
+            for q_id, answers_current in engine.run(sys.stdin):
+                write_answers(answer_file, q_id, answers_current)
+            engine.print_stats(sys.stderr)
+        else:
+            for question in sys.stdin:
+                q_id, q = question.strip().split('\t')
+                try:
+                    answers_current = qa_system(q)
+                except NoAnswerError:
+                    answers_current = None
+                except DeadlineExceeded as err:
+                    answers_current = err
+                write_answers(answer_file, q_id, answers_current)
+
+    save_solver_state(qa_system)
+    print_solver_stats(qa_system, sys.stderr)
+
+    if args.http_stats:
+        shared_transport().print_stats(sys.stderr)
 
 
 if __name__ == '__main__':
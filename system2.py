@@ -1,18 +1,22 @@
 #! /usr/bin/env python3
 # -*- coding: utf-8 -*-
 
-import spacy
+import argparse
 import sys
 
 from spacy.matcher import Matcher
 
-from datetime import datetime
-from requests import get
-from SPARQLWrapper import SPARQLWrapper, JSON
-
 # handle input
 from unidecode import unidecode
 
+from answers import from_bindings
+from evaluation import Evaluation, ResultStore, print_report
+from models import get_matcher, get_model
+from parse_cache import ParseCache
+from rate_limit import Throttled
+from search_cache import MISS
+from transport import get, sparql
+
 
 class NoAnswerError(Exception):
     def __init__(self, *args, **kwargs):
@@ -33,15 +37,43 @@ class QuestionParser:
         'born':    'birth',
     }
 
-    def __init__(self):
-        self.nlp = spacy.load('en')
-        self.matcher = self.init_matcher()
+    def __init__(self, cache_path=None):
+        # het model en de matcher worden gedeeld met de rest van het proces, zie models.py
+        self.nlp = get_model('en')
+        self.matcher = get_matcher('en', 'system2.QuestionParser', self.init_matcher)
+        # LRU cache van geparsede vragen, met een cache_path ook bewaard als DocBin (zie parse_cache.py)
+        self.cache = ParseCache(self.nlp.vocab, 1024, cache_path)
 
     # parse een vraag met de juiste parser functie en translate de entity/property
     def __call__(self, question):
+        question = self.prepare(question)
+        result = self.cache.get_result(question)
+        if result is MISS:
+            try:
+                result = self.parse_doc(self.parse(question))
+            except NoAnswerError as err:
+                result = err
+            self.cache.put_result(question, result)
+        if isinstance(result, NoAnswerError):
+            raise NoAnswerError(*result.args)
+        return result
+
+    @staticmethod
+    def prepare(question):
+        question = question.strip()
         if question[-1] != "?":
             question += "?"
-        result = self.nlp(question.strip())
+        return question
+
+    # de geparsede Doc van een vraag, uit de cache als we de vraag al eens gezien hebben
+    def parse(self, question):
+        doc = self.cache.get_doc(question)
+        if doc is None:
+            doc = self.nlp(question)
+            self.cache.put_doc(question, doc)
+        return doc
+
+    def parse_doc(self, result):
         try:
             match_id, start, end = self.matcher(result)[0]
         except IndexError:
@@ -55,9 +87,10 @@ class QuestionParser:
         ent = ' '.join(w for w in ent if w not in self.stop_words) if ent is not None else None
         return result.vocab.strings[match_id], ent, prop, extra
 
-    def init_matcher(self):
+    @staticmethod
+    def init_matcher(nlp):
         # hier komen de patterns voor het identificeren van vraagtypes
-        matcher = Matcher(self.nlp.vocab)
+        matcher = Matcher(nlp.vocab)
         matcher.add('X_OF_Y', None,
                     [
                         {'DEP': {'IN': ['attr', 'advmod', 'nsubj']}, 'LOWER': {'IN': ['who', 'what', 'when']}},
@@ -418,10 +451,10 @@ class QuestionParser:
 
 
 class QuestionSolver:
-    def __init__(self):
-        self.sparql = SPARQLWrapper('https://query.wikidata.org/sparql')
+    def __init__(self, parse_cache_path=None):
+        self.sparql_url = 'https://query.wikidata.org/sparql'
         self.wiki_api_url = 'https://www.wikidata.org/w/api.php'
-        self.parser = QuestionParser()
+        self.parser = QuestionParser(parse_cache_path)
 
         self.query_dict = {
 
@@ -519,19 +552,13 @@ class QuestionSolver:
             raise
 
     def print_question(self, question):
-        for token in self.parser.nlp(question.strip()):
+        for token in self.parser.parse(self.parser.prepare(question)):
             print('\t'.join((token.text, token.lemma_, token.pos_, token.tag_, token.dep_, token.head.lemma_)))
 
     @staticmethod
     def print_answers(answers):
-        for i in range(len(answers)):
-            try:
-                date = datetime.strptime(answers[i], '%Y-%m-%dT%H:%M:%SZ')
-                answers[i] = date.strftime('%m/%d/%Y')
-            except ValueError:
-                pass
-
-            print(answers[i])
+        for answer in answers:
+            print(answer.format('%m/%d/%Y'))
 
         return answers
 
@@ -581,80 +608,73 @@ class QuestionSolver:
 
                 # vul de query string met de gevonden entity/property/extra in de vraag
                 query_string = query_string.format(wikidata_entity, wikidata_prop, extra)
-                self.sparql.setQuery(query_string)
-                self.sparql.setReturnFormat(JSON)
-                results = self.sparql.query().convert()['results']['bindings']
+                results = sparql(query_string, self.sparql_url)['results']['bindings']
 
                 # geen resultaten voor deze combinatie, probeer de volgende
                 if not results:
                     continue
 
-                # resultaat / resultaten gevonden, return de resultaten
-                answers = []
-                for result in results:
-                    for var in result:
-                        answer = result[var]['value']
-                        try:
-                            # convert resultaat naar een datum als het nodig is
-                            date = datetime.strptime(answer, '%Y-%m-%dT%H:%M:%SZ')
-                            answer = date.strftime('%Y-%m-%d')
-                        except ValueError:
-                            pass
-                        answers.append(answer)
-
-                return answers
+                # resultaat / resultaten gevonden, een Answer per waarde met het type uit de binding
+                return from_bindings(results)
 
         raise NoAnswerError
 
 
 def main():
+    arg_parser = argparse.ArgumentParser(description='Answer questions from standard input, or measure the accuracy')
+    arg_parser.add_argument('gold', nargs='?', help='tsv file with questions, urls and answers to evaluate on')
+    arg_parser.add_argument('--parse-cache', metavar='PATH',
+                            help='spaCy DocBin file with the parsed questions, reused between runs')
+    arg_parser.add_argument('--results', metavar='PATH', default='eval_results.json',
+                            help='json file with the result per gold question, only questions whose parser/solver '
+                                 'code changed are answered again (default %(default)s)')
+    arg_parser.add_argument('--results-max-age', metavar='SECONDS', type=float, default=7 * 24 * 3600,
+                            help='answer a gold question again when its stored result is older than this')
+    arg_parser.add_argument('--recompute', action='store_true',
+                            help='answer every gold question again, but still compare with the previous run')
+    arg_parser.add_argument('--workers', metavar='N', type=int, default=8,
+                            help='number of gold questions looked up on wikidata at the same time')
+    args = arg_parser.parse_args()
+
     print('Loading up QA System...')
-    qa_system = QuestionSolver()
+    qa_system = QuestionSolver(args.parse_cache)
     print('Ready to go!\n')
     # answer questions from standard input
-    if len(sys.argv) == 2:
-        correct_answers = 0
-        num_questions = 0
-        with open(sys.argv[1], 'r') as questions_file:
-            with open('syslog.txt', 'w') as log_file:
-                for question in questions_file:
-
-                    # skip gecommentte vragen
-                    if question[0] == "#":
-                        continue
-                    num_questions += 1
-
-                    print('-----------------------\n')
-                    q, url, *answers = question.strip().split('\t')
-                    print(q)
-                    # print('Actual answer(s):')
-                    # for a in answers:
-                    # print(a)
-                    try:
-                        answers_current = qa_system(q)
-                        right_answer = 0
-                        if answers_current != None:
-                            for answer in answers_current:
-                                print(answer)
-                                if answer.strip() in answers:
-                                    right_answer += 1
-                            if right_answer / len(answers_current) >= 0.5:
-                                correct_answers += 1
-                        else:
-                            print('{}\t{}\t{}'.format(q, answers, answers_current), file=log_file)
-                    except NoAnswerError:
-                        print('{}\t{}'.format(q, 'No answers found'), file=log_file)
-                    # print('Our answer(s):')
-
-        print('Accuracy: ', correct_answers / num_questions)
+    if args.gold:
+        questions = []
+        with open(args.gold, 'r') as questions_file:
+            for question in questions_file:
+                # skip gecommentte vragen
+                if question[0] == "#":
+                    continue
+                q, url, *answers = question.strip().split('\t')
+                questions.append((q, answers))
+
+        # alleen de vragen waarvan de code of de query template veranderd is gaan opnieuw naar wikidata
+        store = ResultStore(args.results, args.results_max_age)
+        records = Evaluation(qa_system, NoAnswerError, store, args.workers, not args.recompute).run(questions)
+        with open('syslog.txt', 'w') as log_file:
+            for (q, answers), record in zip(questions, records):
+                print('-----------------------\n')
+                print(q)
+                if record['answers'] is not None:
+                    for answer in record['answers']:
+                        print(answer)
+                else:
+                    print('{}\t{}'.format(q, 'No answers found'), file=log_file)
+
+        qa_system.parser.cache.save()
+        summary = print_report(questions, records, store, sys.stdout)
+        store.save(questions, records, summary)
     else:
         for question in sys.stdin:
             qa_system.print_question(question)
             try:
                 answers_current = qa_system(question)
                 qa_system.print_answers(answers_current)
-            except NoAnswerError as err:
+            except (NoAnswerError, Throttled) as err:
                 print(err)
+        qa_system.parser.cache.save()
 
 
 if __name__ == '__main__':
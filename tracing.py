@@ -0,0 +1,95 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# per-question tracing for QuestionParser and QuestionSolver
+# a Tracer can be used wherever a stage timer is expected (see stages.py): every stage becomes a span
+# that is written as one json line with its trace id, parent span, start/end timestamps, attributes
+# (matched pattern, search string, cache hit/miss, entity/property ids, ...) and outcome
+#
+#   tracer = Tracer('trace.jsonl')
+#   qa_system.use_timer(tracer)     # tracing on
+#   tracer.enabled = False          # off again, spans cost nothing but an attribute check
+#
+# the open span is kept in a context variable, so concurrent questions (pipeline stages, --workers, the daemon,
+# asyncio) each have their own. work handed to another thread runs in a copy of the context of the question
+# (contextvars.copy_context().run), so its spans and annotations end up under that question.
+
+import contextvars
+import itertools
+import json
+import threading
+import time
+import uuid
+
+from stages import NULL_TIMER
+
+
+class Span:
+    __slots__ = ('tracer', 'name', 'attrs', 'trace', 'span', 'parent', 'start', 'token')
+
+    def __init__(self, tracer, name, attrs):
+        self.tracer = tracer
+        self.name = name
+        self.attrs = attrs
+
+    def __enter__(self):
+        tracer = self.tracer
+        parent = tracer.current.get()
+        self.trace = parent.trace if parent is not None else uuid.uuid4().hex[:16]
+        self.parent = parent.span if parent is not None else None
+        self.span = next(tracer.ids)
+        self.token = tracer.current.set(self)
+        self.start = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        end = time.time()
+        self.tracer.current.reset(self.token)
+        record = {
+            'trace':       self.trace,
+            'span':        self.span,
+            'parent':      self.parent,
+            'name':        self.name,
+            'start':       self.start,
+            'end':         end,
+            'duration_ms': (end - self.start) * 1000,
+            'outcome':     'ok' if exc_type is None else '{}: {}'.format(exc_type.__name__, exc),
+        }
+        record.update(self.attrs)
+        self.tracer.write(record)
+        return False
+
+
+class Tracer:
+    def __init__(self, path, enabled=True):
+        self.sink = open(path, 'a', encoding='utf-8')
+        self.enabled = enabled
+        self.ids = itertools.count(1)
+        # the innermost open span of the current question
+        self.current = contextvars.ContextVar('span', default=None)
+        self.lock = threading.Lock()
+
+    def stage(self, name, **attrs):
+        if not self.enabled:
+            return NULL_TIMER.stage(name)
+        return Span(self, name, attrs)
+
+    # extra attributes for the span that is currently open in this context
+    def annotate(self, **attrs):
+        if self.enabled:
+            span = self.current.get()
+            if span is not None:
+                span.attrs.update(attrs)
+
+    def remote_call(self, kind):
+        self.annotate(remote=True)
+
+    def write(self, record):
+        line = json.dumps(record, default=str)
+        with self.lock:
+            self.sink.write(line + '\n')
+            self.sink.flush()
+
+    def close(self):
+        with self.lock:
+            self.sink.close()
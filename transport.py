@@ -0,0 +1,113 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# shared http transport for all the QA systems
+# one requests session per process, with keep-alive connection pools per host, gzip responses,
+# timeouts and counters for the connections and bytes that went over the wire.
+# requests are paced per host by the shared RateLimiter, which also retries throttled (429/503) responses
+
+import threading
+
+import requests
+
+from requests.adapters import HTTPAdapter
+
+from rate_limit import shared_limiter
+from replay import recorder, replay_url
+
+SPARQL_URL = 'https://query.wikidata.org/sparql'
+USER_AGENT = 'Language-technology-QA/1.0 (https://github.com/markrobertvandam/Language-technology)'
+
+
+class Transport:
+    def __init__(self, timeout=(5, 60), pool_connections=4, pool_maxsize=16):
+        self.timeout = timeout
+        self.session = requests.Session()
+        # one pool per host (wikidata api and sparql endpoint), each keeping up to pool_maxsize open connections
+        self.adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize)
+        self.session.mount('https://', self.adapter)
+        self.session.mount('http://', self.adapter)
+        self.session.headers.update({
+            'Accept-Encoding': 'gzip, deflate',
+            'User-Agent':      USER_AGENT,
+        })
+        # with QA_RECORD set every response is also written to a fixture file (see replay.py)
+        self.recorder = recorder()
+        self.limiter = shared_limiter()
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.bytes_received = 0
+        self.bytes_decoded = 0
+
+    # budget is the Budget of the question (budget.py): the timeouts shrink to the time it has left,
+    # also when the rate limiter made the request wait
+    def get(self, url, params=None, budget=None, **kwargs):
+        timeout = kwargs.pop('timeout', self.timeout)
+
+        def send():
+            # with QA_REPLAY_URL set the request goes to the local replay server instead,
+            # the rate limit still applies per original host
+            return self.session.get(replay_url(url), params=params,
+                                    timeout=timeout if budget is None else budget.timeout(timeout), **kwargs)
+
+        response = self.limiter.call(url, send, budget)
+        if self.recorder is not None:
+            self.recorder.record(url, params, response.status_code,
+                                 response.headers.get('Content-Type', 'application/json'), response.content,
+                                 response.elapsed.total_seconds())
+        with self.lock:
+            self.requests += 1
+            # raw.tell() counts the (compressed) bytes read from the socket, content is the decoded body
+            self.bytes_received += response.raw.tell() if response.raw is not None else len(response.content)
+            self.bytes_decoded += len(response.content)
+        return response
+
+    def get_json(self, url, params=None, **kwargs):
+        return self.get(url, params, **kwargs).json()
+
+    # same result as SPARQLWrapper(...).query().convert() with the JSON return format
+    def sparql(self, query, url=SPARQL_URL, **kwargs):
+        headers = {'Accept': 'application/sparql-results+json'}
+        return self.get_json(url, {'query': query, 'format': 'json'}, headers=headers, **kwargs)
+
+    def stats(self):
+        opened = 0
+        pool_requests = 0
+        pools = self.adapter.poolmanager.pools
+        for key in pools.keys():
+            pool = pools[key]
+            opened += pool.num_connections
+            pool_requests += pool.num_requests
+        return {
+            'requests':           self.requests,
+            'connections_opened': opened,
+            'connections_reused': pool_requests - opened,
+            'bytes_received':     self.bytes_received,
+            'bytes_decoded':      self.bytes_decoded,
+        }
+
+    def print_stats(self, file):
+        print('HTTP: {requests} requests, {connections_opened} connections opened, {connections_reused} reused, '
+              '{bytes_received} bytes received ({bytes_decoded} bytes decoded)'.format(**self.stats()), file=file)
+        self.limiter.print_stats(file)
+
+
+_shared = None
+_shared_lock = threading.Lock()
+
+
+def shared_transport():
+    global _shared
+    with _shared_lock:
+        if _shared is None:
+            _shared = Transport()
+        return _shared
+
+
+# drop-in replacement for requests.get that goes through the shared transport
+def get(url, params=None, **kwargs):
+    return shared_transport().get(url, params, **kwargs)
+
+
+def sparql(query, url=SPARQL_URL, **kwargs):
+    return shared_transport().sparql(query, url, **kwargs)
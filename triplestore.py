@@ -0,0 +1,325 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# offline wikidata backend for QuestionSolver.query_answer
+# a subset of wikidata (N-Triples or entity JSON) is compiled into one binary file:
+#   - every term (QIDs, literals, labels) gets an integer id, terms are sorted so they can be binary searched
+#   - the statements of a subject are an adjacency list in two arrays (property, object) sorted by property
+#   - english labels and descriptions are arrays indexed by term id
+# the file is memory-mapped, so loading it is instant and the pages are shared between processes
+#
+# build a store with: python3 triplestore.py music.nt music.store
+#
+# query() understands the query shapes of QuestionSolver.query_dict (wd:X wdt:P ?answer, COUNT, ASK and
+# the description lookups), also in the VALUES form of --batch-queries, and returns sparql json results
+
+import json
+import mmap
+import re
+import struct
+import sys
+
+from array import array
+from bisect import bisect_left, bisect_right
+
+MAGIC = b'QAT1'
+HEADER = struct.Struct('<4sIIIIII')
+NONE = 0xFFFFFFFF
+
+ENTITY_PREFIX = 'http://www.wikidata.org/entity/'
+DIRECT_PREFIX = 'http://www.wikidata.org/prop/direct/'
+LABEL_URI = 'http://www.w3.org/2000/01/rdf-schema#label'
+DESCRIPTION_URI = 'http://schema.org/description'
+
+NT_LINE = re.compile(r'<([^>]*)>\s+<([^>]*)>\s+(?:<([^>]*)>|"((?:[^"\\]|\\.)*)"(?:@([\w-]+)|\^\^<[^>]*>)?)\s*\.')
+
+SELECT_VARS = re.compile(r'SELECT (?:DISTINCT )?(.*?) WHERE', re.S)
+VALUES_PAIRS = re.compile(r'\(wd:(Q\d+) wdt:(P\d+)\)')
+VALUES_ENTITIES = re.compile(r'VALUES \?entity \{([^}]*)\}')
+TRIPLE = re.compile(r'(?:wd:(Q\d+)|\?entity) (?:wdt:(P\d+)|\?prop) (?:\?answer|wd:(Q\d+))')
+BIND = re.compile(r'BIND\(wd:(Q\d+) as \?entity\)')
+
+
+def read_ntriples(lines, language='en'):
+    # yields (subject, predicate, object) with wikidata ids instead of full uris
+    for line in lines:
+        match = NT_LINE.match(line)
+        if match is None:
+            continue
+        subject, predicate, obj_uri, literal, lang = match.groups()
+        if lang is not None and lang != language:
+            continue
+        if obj_uri is not None:
+            obj = obj_uri[len(ENTITY_PREFIX):] if obj_uri.startswith(ENTITY_PREFIX) else obj_uri
+        else:
+            obj = json.loads('"{}"'.format(literal))
+        if subject.startswith(ENTITY_PREFIX):
+            subject = subject[len(ENTITY_PREFIX):]
+        if predicate.startswith(DIRECT_PREFIX):
+            predicate = predicate[len(DIRECT_PREFIX):]
+        elif predicate == LABEL_URI:
+            predicate = 'label'
+        elif predicate == DESCRIPTION_URI:
+            predicate = 'description'
+        else:
+            continue
+        yield subject, predicate, obj
+
+
+def snak_value(snak):
+    datavalue = snak.get('datavalue')
+    if datavalue is None:
+        return None
+    value = datavalue['value']
+    if datavalue['type'] == 'wikibase-entityid':
+        return value['id']
+    if datavalue['type'] == 'time':
+        return value['time'].lstrip('+')
+    if datavalue['type'] == 'quantity':
+        return value['amount'].lstrip('+')
+    if datavalue['type'] == 'monolingualtext':
+        return value['text']
+    if isinstance(value, str):
+        return value
+    return None
+
+
+def read_entity_json(lines, language='en'):
+    # wikidata entity dump: one entity per line, optionally wrapped in [ ... ] with trailing commas
+    for line in lines:
+        line = line.strip().rstrip(',')
+        if not line or line in ('[', ']'):
+            continue
+        entity = json.loads(line)
+        subject = entity['id']
+        if language in entity.get('labels', {}):
+            yield subject, 'label', entity['labels'][language]['value']
+        if language in entity.get('descriptions', {}):
+            yield subject, 'description', entity['descriptions'][language]['value']
+        for prop, claims in entity.get('claims', {}).items():
+            # truthy statements: the preferred ones if there are any, otherwise the normal ones
+            preferred = [c for c in claims if c.get('rank') == 'preferred']
+            for claim in preferred or [c for c in claims if c.get('rank') != 'deprecated']:
+                value = snak_value(claim['mainsnak'])
+                if value is not None:
+                    yield subject, prop, value
+
+
+def padded(blob):
+    return blob + b'\0' * (-len(blob) % 4)
+
+
+def string_table(strings):
+    offsets = array('I', [0])
+    blob = bytearray()
+    for string in strings:
+        blob += string.encode('utf-8')
+        offsets.append(len(blob))
+    return offsets, bytes(blob)
+
+
+def build(triples, path):
+    statements = []
+    labels = {}
+    descriptions = {}
+    for subject, predicate, obj in triples:
+        if predicate == 'label':
+            labels[subject] = obj
+        elif predicate == 'description':
+            descriptions[subject] = obj
+        else:
+            statements.append((subject, predicate, obj))
+
+    terms = set(labels) | set(labels.values()) | set(descriptions) | set(descriptions.values())
+    for subject, _, obj in statements:
+        terms.add(subject)
+        terms.add(obj)
+    terms = sorted(terms)
+    term_ids = {term: i for i, term in enumerate(terms)}
+    props = sorted({predicate for _, predicate, _ in statements})
+    prop_ids = {prop: i for i, prop in enumerate(props)}
+
+    edges = sorted({(term_ids[s], prop_ids[p], term_ids[o]) for s, p, o in statements})
+    edge_offsets = array('I', [0] * (len(terms) + 1))
+    for subject, _, _ in edges:
+        edge_offsets[subject + 1] += 1
+    for i in range(len(terms)):
+        edge_offsets[i + 1] += edge_offsets[i]
+    edge_pred = array('I', (p for _, p, _ in edges))
+    edge_obj = array('I', (o for _, _, o in edges))
+
+    label_ids = array('I', [NONE]) * len(terms)
+    for term, label in labels.items():
+        label_ids[term_ids[term]] = term_ids[label]
+    description_ids = array('I', [NONE]) * len(terms)
+    for term, description in descriptions.items():
+        description_ids[term_ids[term]] = term_ids[description]
+
+    term_offsets, term_blob = string_table(terms)
+    prop_offsets, prop_blob = string_table(props)
+    with open(path, 'wb') as store_file:
+        store_file.write(HEADER.pack(MAGIC, len(terms), len(padded(term_blob)), len(edges), len(props),
+                                     len(padded(prop_blob)), 0))
+        store_file.write(b'\0' * (-HEADER.size % 4))
+        for section in (term_offsets, padded(term_blob), edge_offsets, edge_pred, edge_obj, label_ids,
+                        description_ids, prop_offsets, padded(prop_blob)):
+            store_file.write(section if isinstance(section, bytes) else section.tobytes())
+    return len(terms), len(edges)
+
+
+class TripleStore:
+    def __init__(self, path):
+        with open(path, 'rb') as store_file:
+            self.mmap = mmap.mmap(store_file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, n_terms, blob_len, n_edges, n_props, prop_blob_len, _ = HEADER.unpack_from(self.mmap)
+        if magic != MAGIC:
+            raise ValueError('{} is not a triple store file'.format(path))
+        if sys.byteorder != 'little':
+            raise ValueError('triple store files can only be read on little-endian machines')
+
+        view = memoryview(self.mmap)
+        position = HEADER.size + (-HEADER.size % 4)
+
+        def section(length, cast=True):
+            nonlocal position
+            part = view[position:position + length]
+            position += length
+            return part.cast('I') if cast else part
+
+        self.n_terms = n_terms
+        self.term_offsets = section((n_terms + 1) * 4)
+        self.term_blob = section(blob_len, cast=False)
+        self.edge_offsets = section((n_terms + 1) * 4)
+        self.edge_pred = section(n_edges * 4)
+        self.edge_obj = section(n_edges * 4)
+        self.labels = section(n_terms * 4)
+        self.descriptions = section(n_terms * 4)
+        prop_offsets = section((n_props + 1) * 4)
+        prop_blob = section(prop_blob_len, cast=False)
+        # the property table is tiny, so it is kept as a dict
+        self.props = {bytes(prop_blob[prop_offsets[i]:prop_offsets[i + 1]]).decode('utf-8'): i
+                      for i in range(n_props)}
+
+    def term(self, term_id):
+        return bytes(self.term_blob[self.term_offsets[term_id]:self.term_offsets[term_id + 1]]).decode('utf-8')
+
+    def term_id(self, term):
+        # binary search over the sorted term table
+        key = term.encode('utf-8')
+        low, high = 0, self.n_terms
+        while low < high:
+            middle = (low + high) // 2
+            if bytes(self.term_blob[self.term_offsets[middle]:self.term_offsets[middle + 1]]) < key:
+                low = middle + 1
+            else:
+                high = middle
+        if low < self.n_terms and self.term(low) == term:
+            return low
+        return None
+
+    def object_ids(self, entity, prop):
+        subject = self.term_id(entity)
+        pred = self.props.get(prop)
+        if subject is None or pred is None:
+            return []
+        start, end = self.edge_offsets[subject], self.edge_offsets[subject + 1]
+        low = bisect_left(self.edge_pred, pred, start, end)
+        high = bisect_right(self.edge_pred, pred, low, end)
+        return self.edge_obj[low:high].tolist()
+
+    def objects(self, entity, prop):
+        return [self.term(obj) for obj in self.object_ids(entity, prop)]
+
+    def count(self, entity, prop):
+        return len(self.object_ids(entity, prop))
+
+    def holds(self, entity, prop, obj):
+        obj_id = self.term_id(obj)
+        return obj_id is not None and obj_id in self.object_ids(entity, prop)
+
+    # like the wikibase label service: the label if there is one, the id itself otherwise
+    def label(self, term):
+        term_id = self.term_id(term)
+        if term_id is None or self.labels[term_id] == NONE:
+            return term
+        return self.term(self.labels[term_id])
+
+    def description(self, term):
+        term_id = self.term_id(term)
+        if term_id is None or self.descriptions[term_id] == NONE:
+            return None
+        return self.term(self.descriptions[term_id])
+
+    def query(self, query_string):
+        projection = SELECT_VARS.search(query_string)
+        projection = projection.group(1) if projection else ''
+        # the projected variables, without the ones that are only used inside count(...)
+        variables = [v for v in re.findall(r'\?(\w+)', projection) if 'count(?{}'.format(v) not in projection]
+        triple = TRIPLE.search(query_string)
+
+        # the (entity, property) pairs, from VALUES or from the query itself
+        if 'VALUES (?entity ?prop)' in query_string:
+            bindings = VALUES_PAIRS.findall(query_string)
+        elif 'VALUES ?entity' in query_string:
+            entities = re.findall(r'wd:(Q\d+)', VALUES_ENTITIES.search(query_string).group(1))
+            bindings = [(entity, triple.group(2) if triple else '') for entity in entities]
+        elif triple is not None:
+            bindings = [(triple.group(1), triple.group(2))]
+        else:
+            bindings = [(BIND.search(query_string).group(1), '')]
+
+        if query_string.startswith('ASK'):
+            return {'boolean': any(self.holds(e, p, triple.group(3)) for e, p in bindings)}
+
+        rows = []
+        for entity, prop in bindings:
+            key = {}
+            if 'entity' in variables:
+                key['entity'] = uri(ENTITY_PREFIX + entity)
+            if 'prop' in variables:
+                key['prop'] = uri(DIRECT_PREFIX + prop)
+
+            if triple is None:
+                # BIND(wd:X as ?entity): label and/or description of the entity itself
+                row = dict(key)
+                if 'entityLabel' in variables:
+                    row['entityLabel'] = literal(self.label(entity))
+                description = self.description(entity)
+                if 'entityDescription' in variables and description is not None:
+                    row['entityDescription'] = literal(description)
+                rows.append(row)
+            elif triple.group(3) is not None:
+                if self.holds(entity, prop, triple.group(3)):
+                    rows.append(key)
+            elif 'count(' in query_string:
+                count = self.count(entity, prop)
+                # without GROUP BY a COUNT always gives a row, with GROUP BY only for the groups that exist
+                if count or 'GROUP BY' not in query_string:
+                    rows.append(dict(key, answerLabel=literal(str(count))))
+            else:
+                for obj in self.objects(entity, prop):
+                    rows.append(dict(key, answerLabel=literal(self.label(obj))))
+        return {'head': {'vars': variables}, 'results': {'bindings': rows}}
+
+
+def uri(value):
+    return {'type': 'uri', 'value': value}
+
+
+def literal(value):
+    return {'type': 'literal', 'value': value}
+
+
+def main():
+    if len(sys.argv) != 3:
+        print('Usage: python3 triplestore.py <subset.nt|subset.json> <output.store>', file=sys.stderr)
+        sys.exit(1)
+    source, path = sys.argv[1:]
+    with open(source, encoding='utf-8') as source_file:
+        reader = read_entity_json if source.endswith(('.json', '.jsonl')) else read_ntriples
+        n_terms, n_edges = build(reader(source_file), path)
+    print('Wrote {} terms and {} statements to {}'.format(n_terms, n_edges, path))
+
+
+if __name__ == '__main__':
+    main()